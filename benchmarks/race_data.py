@@ -0,0 +1,48 @@
+from itertools import islice, product
+from string import ascii_lowercase, ascii_uppercase, digits
+import datetime
+import random
+
+ABBREVIATION_ALPHABET = ascii_uppercase + digits + ascii_lowercase
+MAX_RACERS = len(ABBREVIATION_ALPHABET) ** 3
+RACE_START = datetime.datetime(2018, 5, 24, 12, 0)
+START_WINDOW_MS = 20 * 60 * 1000
+LAP_TIME_RANGE_MS = (60000, 75000)
+TEAMS = 10
+
+
+def abbreviations(racers):
+    """The first racers distinct three character abbreviations, the fixed width of the log records."""
+    if racers > MAX_RACERS:
+        raise ValueError(f'the log layout allows at most {MAX_RACERS} distinct abbreviations, got {racers}')
+    return [''.join(letters) for letters in islice(product(ABBREVIATION_ALPHABET, repeat=3), racers)]
+
+
+def write_race(directory, racers, dnf_ratio=0.05, seed=0):
+    """
+    Writes start.log, end.log and abbreviations.txt for a synthetic race of racers racers into directory and returns
+    their paths. Log records are shuffled like in the real logs, dnf_ratio of the racers finish before they start.
+    """
+    generator = random.Random(seed)
+    codes = abbreviations(racers)
+    start_records, end_records = [], []
+    for code in codes:
+        start_ms = generator.randrange(START_WINDOW_MS)
+        lap_time_ms = generator.randrange(*LAP_TIME_RANGE_MS)
+        if generator.random() < dnf_ratio:
+            lap_time_ms = -lap_time_ms
+        start_records.append(log_record(code, start_ms))
+        end_records.append(log_record(code, start_ms + lap_time_ms))
+    generator.shuffle(start_records)
+    generator.shuffle(end_records)
+    paths = [directory / 'start.log', directory / 'end.log', directory / 'abbreviations.txt']
+    abbreviation_records = (f'{code}_Driver {index}_TEAM {index % TEAMS}\n' for index, code in enumerate(codes))
+    for path, lines in zip(paths, (start_records, end_records, abbreviation_records)):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+    return paths
+
+
+def log_record(abbreviation, offset_ms):
+    timestamp = RACE_START + datetime.timedelta(milliseconds=offset_ms)
+    return f'{abbreviation}{timestamp:%Y-%m-%d_%H:%M:%S}.{timestamp.microsecond // 1000:03d}\n'
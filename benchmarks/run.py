@@ -0,0 +1,115 @@
+"""
+Benchmarks the ingest and the report endpoints on synthetic races:
+
+    python -m benchmarks.run --sizes 10,1000,100000 --requests 50 --output results.json
+
+For every size a race is generated, loaded with from_files_to_db into a fresh database file and the report endpoints
+are requested through the Flask test client, once with the response cache invalidated before every request (cold)
+and once served from the cache (warm). The results are written as JSON so runs can be compared.
+"""
+from benchmarks.race_data import write_race, MAX_RACERS
+from main import app, create_tables, from_files_to_db, report_cache
+from models import init_database
+from pathlib import Path
+import click
+import datetime
+import json
+import math
+import platform
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_SIZES = '10,1000,10000,100000'
+DEFAULT_REQUESTS = 50
+ENDPOINTS = (('report', '/api/v1/report/'), ('drivers', '/api/v1/report/drivers/'))
+FORMATS = ('json', 'xml')
+
+
+def percentile(samples, percent):
+    """The nearest-rank percentile of samples."""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def benchmark_ingest(directory, racers, seed):
+    paths = write_race(directory, racers, seed=seed)
+    create_tables()
+    started = time.perf_counter()
+    ingested = from_files_to_db(*paths)
+    elapsed = time.perf_counter() - started
+    return {'racers': ingested, 'seconds': elapsed, 'racers_per_second': ingested / elapsed,
+            'input_bytes': sum(path.stat().st_size for path in paths)}
+
+
+def benchmark_endpoint(client, url, requests, cold):
+    latencies = []
+    for _ in range(requests):
+        if cold:
+            report_cache.invalidate()
+        started = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise click.ClickException(f'{url} answered {response.status_code}')
+    if cold:
+        report_cache.invalidate()
+    tracemalloc.start()
+    try:
+        client.get(url)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'requests': requests,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            'response_bytes': len(response.data),
+            'peak_memory_bytes': peak_memory}
+
+
+def benchmark_size(racers, requests, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        database = init_database(str(Path(directory) / 'benchmark.db'))
+        try:
+            result = {'size': racers, 'ingest': benchmark_ingest(Path(directory), racers, seed), 'endpoints': []}
+            client = app.test_client()
+            for endpoint, path in ENDPOINTS:
+                for format_for_output in FORMATS:
+                    for cold in (True, False):
+                        timings = benchmark_endpoint(client, f'{path}?format={format_for_output}', requests, cold)
+                        result['endpoints'].append(dict(endpoint=endpoint, format=format_for_output,
+                                                        cache='cold' if cold else 'warm', **timings))
+        finally:
+            database.close()
+    return result
+
+
+@click.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True,
+              help=f'Comma separated numbers of racers, at most {MAX_RACERS}.')
+@click.option('--requests', default=DEFAULT_REQUESTS, show_default=True, help='Requests per endpoint and format.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default='benchmark-results.json', show_default=True)
+def main(sizes, requests, seed, output):
+    """Benchmarks from_files_to_db and the report endpoints and writes the results to OUTPUT."""
+    results = {'started': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'sizes': []}
+    for racers in (int(size) for size in sizes.split(',')):
+        result = benchmark_size(racers, requests, seed)
+        results['sizes'].append(result)
+        ingest = result['ingest']
+        click.echo(f'{racers} racers: ingest {ingest["seconds"]:.3f}s ({ingest["racers_per_second"]:.0f} racers/s)')
+        for timings in result['endpoints']:
+            click.echo(f'  {timings["endpoint"]:8} {timings["format"]:4} {timings["cache"]:4} '
+                       f'p50 {timings["p50_ms"]:9.2f}ms  p99 {timings["p99_ms"]:9.2f}ms  '
+                       f'peak {timings["peak_memory_bytes"] / 1024:9.0f}KiB')
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    click.echo(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+import gzip
+import hashlib
+import zlib
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'mimetype', 'headers', 'etag', 'encoded'])
+
+COMPRESSORS = {'gzip': lambda body: gzip.compress(body, mtime=0),
+               'deflate': zlib.compress}
+
+
+def encoded_body(entry, encoding):
+    """Returns the entry's body compressed with encoding (gzip or deflate), compressing it only once per entry."""
+    body = entry.encoded.get(encoding)
+    if body is None:
+        body = entry.encoded[encoding] = COMPRESSORS[encoding](entry.body)
+    return body
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of serialized responses. Entries are stored under the data version they were built from, so
+    bumping the version with invalidate() makes every older entry unreachable at once. sync() invalidates the cache
+    when the data version shared with other processes moved on.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.version = 0
+        self.shared_version = None
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is not None:
+                self._entries.move_to_end((version, key))
+            return entry
+
+    def put(self, version, key, body, mimetype, headers=()):
+        entry = CachedResponse(body, mimetype, tuple(headers), hashlib.sha1(body).hexdigest(), {})
+        if self.maxsize <= 0:
+            return entry
+        with self._lock:
+            if version == self.version:
+                self._entries[(version, key)] = entry
+                self._entries.move_to_end((version, key))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def sync(self, shared_version):
+        """Invalidates the cache unless its entries were built at shared_version, returns the cache version."""
+        with self._lock:
+            if shared_version != self.shared_version:
+                self.shared_version = shared_version
+                self.version += 1
+                self._entries.clear()
+            return self.version
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
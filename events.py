@@ -0,0 +1,140 @@
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+import json
+import logging
+
+EVENT_POLL_INTERVAL = 1.0
+EVENT_KEEPALIVE = 15.0
+SUBSCRIBER_QUEUE_SIZE = 64
+
+logger = logging.getLogger(__name__)
+
+
+def report_diff(previous, current):
+    """
+    The changes between two report snapshots ({abbreviation: racer dict with a place}): racers that got a place
+    (finished), racers whose place changed (moved), other new or changed racers (updated) and removed abbreviations.
+    Returns None when nothing changed.
+    """
+    finished, moved, updated = [], [], []
+    for abbreviation, racer in current.items():
+        previous_racer = previous.get(abbreviation)
+        if previous_racer == racer:
+            continue
+        previous_place = previous_racer['place'] if previous_racer else None
+        if previous_place is None and racer['place'] is not None:
+            finished.append(racer)
+        elif previous_racer and previous_racer['place'] != racer['place'] \
+                and dict(previous_racer, place=racer['place']) == racer:
+            moved.append({'abbreviation': abbreviation, 'place': racer['place'], 'previous_place': previous_place})
+        else:
+            updated.append(racer)
+    removed = sorted(abbreviation for abbreviation in previous if abbreviation not in current)
+    if not (finished or moved or updated or removed):
+        return None
+    return {'finished': finished, 'moved': moved, 'updated': updated, 'removed': removed}
+
+
+def format_event(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class ReportBroadcaster:
+    """
+    Pushes report changes to Server-Sent Events subscribers. A single background thread, started with the first
+    subscriber, waits for notify() (writes made by this process) or a change of data_version() (commits made by other
+    processes, such as the follow command), loads the report snapshot once, diffs it against the previous one and puts
+    the same serialized event into every subscriber's queue, so the cost of a change does not grow with the number of
+    subscribers. A new subscriber first receives the current snapshot. A subscriber whose queue is full is dropped;
+    its client reconnects and starts again from a snapshot.
+    """
+
+    def __init__(self, load_snapshot, data_version=None, interval=EVENT_POLL_INTERVAL,
+                 queue_size=SUBSCRIBER_QUEUE_SIZE, keepalive=EVENT_KEEPALIVE):
+        self.load_snapshot = load_snapshot
+        self.data_version = data_version
+        self.interval = interval
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.event_id = 0
+        self.snapshot = None
+        self._snapshot_event = None
+        self._version = None
+        self._subscribers = set()
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread = None
+
+    def subscribe(self):
+        """Registers a subscriber, returns its queue of serialized events, starting with the current snapshot."""
+        subscriber = Queue(self.queue_size)
+        with self._lock:
+            if not self._subscribers or self.snapshot is None:
+                self.snapshot = self.load_snapshot()
+                self._snapshot_event = None
+            if self._snapshot_event is None:
+                self._snapshot_event = format_event(self.event_id, 'snapshot', list(self.snapshot.values()))
+            subscriber.put_nowait(self._snapshot_event)
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = Thread(target=self.run, name='report-events', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                self.snapshot = None
+
+    def is_subscribed(self, subscriber):
+        return subscriber in self._subscribers
+
+    def notify(self):
+        """Wakes the broadcast thread after a write to the report."""
+        self._wake.set()
+
+    def run(self):
+        while True:
+            woken = self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._subscribers:
+                continue
+            try:
+                version = self.data_version() if self.data_version else None
+                if woken or version != self._version:
+                    self._version = version
+                    self.publish()
+            except Exception:
+                logger.exception('Broadcasting the report changes failed')
+
+    def publish(self):
+        """Diffs the current snapshot against the last one and sends the changes to every subscriber."""
+        with self._lock:
+            if self.snapshot is None:
+                return None
+            current = self.load_snapshot()
+            diff = report_diff(self.snapshot, current)
+            self.snapshot = current
+            if diff is None:
+                return None
+            self.event_id += 1
+            self._snapshot_event = None
+            event = format_event(self.event_id, 'diff', diff)
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(event)
+                except Full:
+                    self._subscribers.discard(subscriber)
+            return diff
+
+    def stream(self, subscriber):
+        """The subscriber's events as a text/event-stream body, with keep-alive comments while nothing changes."""
+        try:
+            while self.is_subscribed(subscriber) or not subscriber.empty():
+                try:
+                    yield subscriber.get(timeout=self.keepalive)
+                except Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
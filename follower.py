@@ -0,0 +1,154 @@
+from models import RacerTable, ReportTable, index_racers, lap_time_to_ms, bump_data_version
+from log_parser import LOG_RECORD_LENGTH, parse_log_line, parse_abbreviation_line, lap_time_between
+from peewee import chunked
+import os
+
+FOLLOW_INTERVAL = 1.0
+UPSERT_BATCH_SIZE = 100
+
+
+class LogFollower:
+    """
+    Follows the start/end logs of a live session. Every poll() reads only the bytes appended since the previous one,
+    upserts the racers whose name, start or finish time is new or changed, refreshes their search index entries and
+    renumbers only the report places affected by those lap times. The abbreviations file is small and is re-read
+    whenever it changes on disk.
+    """
+
+    def __init__(self, start_path, finish_path, abbreviations_path, on_change=None):
+        self.start_path = start_path
+        self.finish_path = finish_path
+        self.abbreviations_path = abbreviations_path
+        self.on_change = on_change
+        self.offsets = {start_path: 0, finish_path: 0}
+        self.fragments = {start_path: b'', finish_path: b''}
+        self.abbreviations_stat = None
+        self.racers = {}
+        self.start_times = {}
+        self.finish_times = {}
+        self.stored = {}
+
+    def poll(self):
+        """Applies the new log records to the database, returns the abbreviations of the updated racers."""
+        touched = set(self.read_abbreviations())
+        for line in self.read_new_lines(self.start_path):
+            abbreviation, start_time = parse_log_line(line)
+            self.start_times[abbreviation] = start_time
+            touched.add(abbreviation)
+        for line in self.read_new_lines(self.finish_path):
+            abbreviation, finish_time = parse_log_line(line)
+            self.finish_times[abbreviation] = finish_time
+            touched.add(abbreviation)
+        rows = [row for row in map(self.racer_row, sorted(touched)) if row is not None]
+        if not rows:
+            return []
+        self.store(rows)
+        if self.on_change:
+            self.on_change()
+        return [row['abbreviation'] for row in rows]
+
+    def read_abbreviations(self):
+        try:
+            stat = os.stat(self.abbreviations_path)
+        except FileNotFoundError:
+            return []
+        if (stat.st_size, stat.st_mtime_ns) == self.abbreviations_stat:
+            return []
+        self.abbreviations_stat = (stat.st_size, stat.st_mtime_ns)
+        changed = []
+        with open(self.abbreviations_path) as file:
+            for line in file:
+                if line.strip():
+                    abbreviation, name, team = parse_abbreviation_line(line)
+                    if self.racers.get(abbreviation) != (name, team):
+                        self.racers[abbreviation] = (name, team)
+                        changed.append(abbreviation)
+        return changed
+
+    def read_new_lines(self, path):
+        """
+        Returns the complete records appended to path since the last call. An unterminated trailing fragment is kept
+        for the next call, unless it already holds a whole fixed-length record. A file that shrank is read again from
+        the beginning.
+        """
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return []
+        with file:
+            if os.fstat(file.fileno()).st_size < self.offsets[path]:
+                self.offsets[path] = 0
+                self.fragments[path] = b''
+            file.seek(self.offsets[path])
+            data = self.fragments[path] + file.read()
+            self.offsets[path] = file.tell()
+        *lines, fragment = data.split(b'\n')
+        if len(fragment.strip()) >= LOG_RECORD_LENGTH:
+            lines.append(fragment)
+            fragment = b''
+        self.fragments[path] = fragment
+        return [line.decode() for line in lines if line.strip()]
+
+    def racer_row(self, abbreviation):
+        """The racer's row once its name, start and finish time are all known and differ from the stored ones."""
+        if abbreviation not in self.racers or abbreviation not in self.start_times \
+                or abbreviation not in self.finish_times:
+            return None
+        name, team = self.racers[abbreviation]
+        start_time, finish_time = self.start_times[abbreviation], self.finish_times[abbreviation]
+        lap_time = lap_time_between(start_time, finish_time)
+        row = {'abbreviation': abbreviation, 'name': name, 'team': team, 'start_time': start_time,
+               'finish_time': finish_time, 'lap_time': lap_time, 'lap_time_ms': lap_time_to_ms(lap_time)}
+        if self.stored.get(abbreviation) == row:
+            return None
+        return row
+
+    def store(self, rows):
+        abbreviations = [row['abbreviation'] for row in rows]
+        with RacerTable._meta.database.atomic():
+            previous_lap_times = dict(RacerTable
+                                      .select(RacerTable.abbreviation, RacerTable.lap_time_ms)
+                                      .where(RacerTable.abbreviation.in_(abbreviations))
+                                      .tuples())
+            for batch in chunked(rows, UPSERT_BATCH_SIZE):
+                (RacerTable
+                 .insert_many(batch)
+                 .on_conflict(conflict_target=[RacerTable.abbreviation],
+                              preserve=[RacerTable.name, RacerTable.team, RacerTable.start_time,
+                                        RacerTable.finish_time, RacerTable.lap_time, RacerTable.lap_time_ms])
+                 .execute())
+            for batch in chunked(abbreviations, UPSERT_BATCH_SIZE):
+                index_racers(batch)
+                (ReportTable
+                 .insert_many([{'abbreviation': abbreviation, 'place': None} for abbreviation in batch])
+                 .on_conflict_ignore()
+                 .execute())
+            lap_times = [lap_time for lap_time in previous_lap_times.values() if lap_time is not None]
+            lap_times += [row['lap_time_ms'] for row in rows if row['lap_time_ms'] is not None]
+            unfinished = [row['abbreviation'] for row in rows if row['lap_time_ms'] is None]
+            if unfinished:
+                ReportTable.update(place=None).where(ReportTable.abbreviation.in_(unfinished)).execute()
+            if lap_times:
+                recompute_places(min(lap_times))
+            bump_data_version()
+        self.stored.update((row['abbreviation'], row) for row in rows)
+
+
+def recompute_places(from_lap_time_ms):
+    """
+    Renumbers the places of the finished racers with a lap time of at least from_lap_time_ms, the only ones a changed
+    lap time can move, and writes just the places that actually changed. Returns the number of updated racers.
+    """
+    faster_racers = RacerTable.select().where(RacerTable.lap_time_ms < from_lap_time_ms).count()
+    affected = (ReportTable
+                .select(ReportTable.abbreviation, ReportTable.place)
+                .join(RacerTable)
+                .where(RacerTable.lap_time_ms >= from_lap_time_ms)
+                .order_by(RacerTable.lap_time_ms, ReportTable.abbreviation)
+                .tuples())
+    updated = 0
+    for place, (abbreviation, current_place) in enumerate(list(affected), start=faster_racers + 1):
+        if current_place != place:
+            ReportTable.update(place=place).where(ReportTable.abbreviation == abbreviation).execute()
+            updated += 1
+    return updated
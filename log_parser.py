@@ -0,0 +1,110 @@
+from array import array
+from collections import namedtuple
+import datetime
+import mmap
+import os
+
+LOG_RECORD_LENGTH = 26
+LOG_TIME_FORMAT = '%Y-%m-%d_%H:%M:%S.%f'
+PARSE_BATCH_SIZE = 4096
+DAY_MS = 86400000
+MISSING_TIME = -1
+
+RaceColumns = namedtuple('RaceColumns', ['abbreviations', 'names', 'teams', 'start_ms', 'finish_ms'])
+
+
+def parse_log_line(line):
+    """
+    Parses a start.log/end.log record, ABBYYYY-MM-DD_HH:MM:SS.mmm with optional trailing whitespace, into
+    (abbreviation, datetime).
+    """
+    line = line.strip()
+    return line[:3], datetime.datetime.strptime(line[3:], LOG_TIME_FORMAT)
+
+
+def parse_abbreviation_line(line):
+    """Parses an abbreviations.txt record, ABB_Name_Team, into (abbreviation, name, team)."""
+    abbreviation, name, team = line.strip().split('_', 2)
+    return abbreviation, name, team
+
+
+def lap_time_between(start_time, finish_time):
+    """Lap time as a timedelta, None when the finish time is not after the start time (did not finish)."""
+    if finish_time <= start_time:
+        return None
+    return finish_time - start_time
+
+
+def iter_log_batches(path, batch_size=PARSE_BATCH_SIZE):
+    """
+    Streams a start.log/end.log file through mmap and yields (abbreviations, timestamps) column batches of at most
+    batch_size records. The fixed record layout is sliced directly; timestamps is an array of milliseconds counted from
+    0001-01-01. Blank lines and trailing whitespace are skipped.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            days = {}
+            abbreviations, timestamps = [], array('q')
+            for line in iter(mapped.readline, b''):
+                line = line.strip()
+                if not line:
+                    continue
+                if len(line) != LOG_RECORD_LENGTH:
+                    raise ValueError(f'{path}: malformed record {line!r}')
+                date = line[3:13]
+                day = days.get(date)
+                if day is None:
+                    day = days[date] = datetime.date(int(date[:4]), int(date[5:7]), int(date[8:])).toordinal() * DAY_MS
+                abbreviations.append(line[:3].decode())
+                timestamps.append(day + int(line[14:16]) * 3600000 + int(line[17:19]) * 60000
+                                  + int(line[20:22]) * 1000 + int(line[23:26]))
+                if len(abbreviations) == batch_size:
+                    yield abbreviations, timestamps
+                    abbreviations, timestamps = [], array('q')
+            if abbreviations:
+                yield abbreviations, timestamps
+
+
+def read_race(start_path, finish_path, abbreviations_path, batch_size=PARSE_BATCH_SIZE):
+    """
+    Reads a race into RaceColumns: one column per attribute in abbreviations.txt order, with the start and finish
+    timestamps scattered into arrays (MISSING_TIME where a log has no record for the racer).
+    """
+    abbreviations, names, teams = [], [], []
+    with open(abbreviations_path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                abbreviation, name, team = parse_abbreviation_line(line)
+                abbreviations.append(abbreviation)
+                names.append(name)
+                teams.append(team)
+    positions = {abbreviation: position for position, abbreviation in enumerate(abbreviations)}
+    start_ms = array('q', [MISSING_TIME]) * len(abbreviations)
+    finish_ms = array('q', [MISSING_TIME]) * len(abbreviations)
+    for column, path in ((start_ms, start_path), (finish_ms, finish_path)):
+        for batch_abbreviations, batch_timestamps in iter_log_batches(path, batch_size):
+            for abbreviation, timestamp in zip(batch_abbreviations, batch_timestamps):
+                position = positions.get(abbreviation)
+                if position is not None:
+                    column[position] = timestamp
+    return RaceColumns(abbreviations, names, teams, start_ms, finish_ms)
+
+
+def race_rows(race):
+    """
+    Lazily yields (abbreviation, name, team, start_time, finish_time, lap_time, lap_time_ms) rows of the racers with
+    both a start and a finish time, ready for a bulk insert. Racers who finished before they started get no lap time.
+    """
+    for abbreviation, name, team, start, finish in zip(*race):
+        if start == MISSING_TIME or finish == MISSING_TIME:
+            continue
+        lap_time_ms = finish - start if finish > start else None
+        yield (abbreviation, name, team, timestamp_to_datetime(start), timestamp_to_datetime(finish),
+               datetime.timedelta(milliseconds=lap_time_ms) if lap_time_ms is not None else None, lap_time_ms)
+
+
+def timestamp_to_datetime(timestamp):
+    day, milliseconds = divmod(timestamp, DAY_MS)
+    return datetime.datetime.fromordinal(day) + datetime.timedelta(milliseconds=milliseconds)
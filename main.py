@@ -1,43 +1,323 @@
-from flask import Flask, request, jsonify, Response
-from flask_restful import Api, Resource
-from application_vlados import processing_data
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_request_context
+from flask_restful import Api, Resource, abort
 from dict2xml import dict2xml
-from flasgger import Swagger
-from models import db, RacerTable, ReportTable
-from peewee import IntegrityError
-from itertools import chain
+from models import db, RacerTable, ReportTable, SourceFileTable, RaceTable, RaceResultTable, StandingTable, \
+    RacerSearchIndex, DataVersionTable, format_lap_time, index_racers, migrate_columns, migrate_schema, \
+    query_listeners, bump_data_version, current_data_version
+from cache import ResponseCache, COMPRESSORS, encoded_body
+from events import ReportBroadcaster
+from metrics import MetricsRegistry, LATENCY_BUCKETS, QUERY_COUNT_BUCKETS, SIZE_BUCKETS
+from follower import LogFollower, FOLLOW_INTERVAL
+from log_parser import read_race, race_rows
+from races import race_to_db, standings_query, latest_season, ingest_race_directories, RACES_PER_COMMIT
+from peewee import IntegrityError, chunked, fn, Case, Tuple, JOIN
+from contextlib import contextmanager
+from threading import Lock
+from urllib.parse import urlencode
+import base64
+import binascii
+import click
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+INGEST_BATCH_SIZE = 100
+REPORT_CACHE_SIZE = 128
+MAX_PAGE_SIZE = 1000
+CACHED_HEADERS = ('Link', 'X-Next-Cursor')
+STREAM_CHUNK_SIZE = 64
+COMPRESSION_MIN_SIZE = 512
+OUTPUT_MIMETYPES = {'json': 'application/json',
+                    'xml': 'application/xml',
+                    'ndjson': 'application/x-ndjson',
+                    'csv': 'text/csv',
+                    'msgpack': 'application/x-msgpack'}
+CSV_FIELDS = ('position', 'place', 'name', 'team', 'points', 'races', 'wins', 'lap_time')
+RACER_FIELDS = [RacerTable.abbreviation, RacerTable.name, RacerTable.team, RacerTable.start_time,
+                RacerTable.finish_time, RacerTable.lap_time, RacerTable.lap_time_ms]
+SWAGGER_PATHS = ('/apidocs', '/apispec', '/flasgger_static')
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '') in ('1', 'true')
+
+
+class LazySwagger:
+    """
+    WSGI middleware serving the Swagger UI. Importing flasgger and building the spec is deferred to a documentation
+    app created on the first request for /apidocs, so importing main and starting workers stay fast.
+    """
+
+    def __init__(self, wsgi_app, create_docs_app):
+        self.wsgi_app = wsgi_app
+        self.create_docs_app = create_docs_app
+        self.docs_app = None
+        self._lock = Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(SWAGGER_PATHS):
+            if self.docs_app is None:
+                with self._lock:
+                    if self.docs_app is None:
+                        self.docs_app = self.create_docs_app()
+            return self.docs_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def create_docs_app():
+    """An app with the same resources as main.app, documented by flasgger."""
+    from flasgger import Swagger
+    docs_app = Flask(__name__)
+    register_resources(Api(docs_app))
+    Swagger(docs_app)
+    return docs_app
+
 
 app = Flask(__name__)
+app.config['SERVER_TIMING'] = SERVER_TIMING
+app.wsgi_app = LazySwagger(app.wsgi_app, create_docs_app)
 api = Api(app)
-swagger = Swagger(app)
+report_cache = ResponseCache(maxsize=REPORT_CACHE_SIZE)
+
+request_metrics = MetricsRegistry()
+request_metrics.counter('report_requests_total', 'Requests served, by endpoint and status code.')
+request_metrics.counter('report_db_query_seconds_total', 'Time spent executing database queries, by endpoint.')
+request_metrics.counter('report_phase_seconds_total',
+                        'Time spent building (serialization included), serializing and compressing responses.')
+request_metrics.histogram('report_request_duration_seconds', 'Time until the response is ready to be sent.',
+                          LATENCY_BUCKETS)
+request_metrics.histogram('report_request_db_queries', 'Database queries executed per request.', QUERY_COUNT_BUCKETS)
+request_metrics.histogram('report_response_size_bytes', 'Size of the response bodies, streamed ones excluded.',
+                          SIZE_BUCKETS)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.phase_seconds = {}
+
+
+def count_query(sql, seconds):
+    """Query listener adding every statement executed while serving a request to the request's counters."""
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += seconds
+
+
+query_listeners.append(count_query)
+
+
+@contextmanager
+def phase_timer(phase):
+    """Adds the time spent in the block to the named phase (build, serialize, compress) of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'phase_seconds' in g:
+            g.phase_seconds[phase] = g.phase_seconds.get(phase, 0.0) + time.perf_counter() - started
+
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Records the request's latency, query count, database time, phase timings and body size under its endpoint. With
+    the SERVER_TIMING config flag the same timings are sent to the client in a Server-Timing header. A streamed
+    response is measured until its headers are ready, its body is not included.
+    """
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    labels = {'endpoint': request.endpoint or 'unmatched'}
+    request_metrics.inc('report_requests_total', dict(labels, status=response.status_code))
+    request_metrics.observe('report_request_duration_seconds', labels, elapsed)
+    request_metrics.observe('report_request_db_queries', labels, g.db_queries)
+    request_metrics.inc('report_db_query_seconds_total', labels, g.db_seconds)
+    for phase, seconds in g.phase_seconds.items():
+        request_metrics.inc('report_phase_seconds_total', dict(labels, phase=phase), seconds)
+    if not response.is_streamed:
+        request_metrics.observe('report_response_size_bytes', labels, response.calculate_content_length())
+    if app.config['SERVER_TIMING']:
+        timings = [f'db;dur={g.db_seconds * 1000:.3f};desc="{g.db_queries} queries"']
+        timings += [f'{phase};dur={seconds * 1000:.3f}' for phase, seconds in g.phase_seconds.items()]
+        timings.append(f'total;dur={elapsed * 1000:.3f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Request metrics in the Prometheus text exposition format."""
+    return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def open_db_connection():
+    g.db_connection_opened = RacerTable._meta.database.connect(reuse_if_open=True)
+
+
+@app.teardown_request
+def close_db_connection(exception):
+    """Closes (or, for a pooled database, returns to the pool) the connection opened for the request."""
+    if g.pop('db_connection_opened', False):
+        RacerTable._meta.database.close()
 
 
 def create_tables():
-    with db:
-        db.create_tables([RacerTable, ReportTable])
+    with db.connection_context():
+        migrate_columns()
+        db.create_tables([RacerTable, ReportTable, SourceFileTable, RaceTable, RaceResultTable, StandingTable,
+                          RacerSearchIndex, DataVersionTable])
+        migrate_schema()
+
+
+def load_source_files(start_path, finish_path, abbreviations_path):
+    """
+    Loads the files into the database unless they are the ones loaded before. Files whose size and modification time
+    match the recorded ones are not read at all, the others are compared by content hash. When any file changed the
+    racers and the report are replaced in one transaction. Returns True when the data was (re)loaded.
+    """
+    paths = [os.path.abspath(path) for path in (start_path, finish_path, abbreviations_path)]
+    recorded = {source_file.path: source_file
+                for source_file in SourceFileTable.select().where(SourceFileTable.path.in_(paths))}
+    fingerprints = []
+    for path in paths:
+        stat = os.stat(path)
+        source_file = recorded.get(path)
+        if source_file and (source_file.size, source_file.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            sha256 = source_file.sha256
+        else:
+            sha256 = file_sha256(path)
+        fingerprints.append({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256})
+    unchanged = all(fingerprint['path'] in recorded and recorded[fingerprint['path']].sha256 == fingerprint['sha256']
+                    for fingerprint in fingerprints)
+    with RacerTable._meta.database.atomic():
+        if not unchanged:
+            ReportTable.delete().execute()
+            RacerTable.delete().execute()
+            bump_data_version()
+            from_files_to_db(start_path, finish_path, abbreviations_path, notify=False)
+        SourceFileTable.replace_many(fingerprints).execute()
+    if not unchanged:
+        data_changed()
+    return not unchanged
+
 
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
 
-def from_files_to_db(start_path, finish_path, abbreviations_path):
+
+def from_files_to_db(start_path, finish_path, abbreviations_path, batch_size=INGEST_BATCH_SIZE, notify=True):
     """
-    The function transfer data from files directly to the database. If the data was transferred earlier, the function
-    will handle the error IntegrityError, and the function won't be process anything.
+    The function transfer data from files directly to the database. The files are parsed into columns and the racers
+    are fed to batched inserts as they are generated, the report places are ranked by integer lap time inside SQLite,
+    all in a single transaction, so the load is atomic: if the data was transferred earlier, the function will handle
+    the error IntegrityError, roll everything back and won't be process anything.
+    data_changed() is called once the racers are stored; a caller running it inside its own transaction passes
+    notify=False and calls data_changed() after committing. Returns the number of ingested racers.
     """
+    started = time.perf_counter()
+    race = read_race(start_path, finish_path, abbreviations_path)
+    racers = 0
     try:
-        structured_info = processing_data(start_path, finish_path, abbreviations_path)
-        sorted_info = sorted(structured_info.values())
-        number_of_valid_racers = len([None for racer in sorted_info if racer.lap_time])
-        racer_number_sequence = iter(range(1, number_of_valid_racers + 1))
-        for racer in sorted_info:
-            driver = RacerTable.create(abbreviation=racer.abbreviation, name=racer.name, team=racer.team,
-                                       start_time=racer.start_time, finish_time=racer.finish_time,
-                                       lap_time=racer.lap_time)
-            if racer.lap_time:
-                racer.place = next(racer_number_sequence)
-                ReportTable.create(abbreviation=driver, place=racer.place)
-            else:
-                ReportTable.create(abbreviation=driver, place=None)
+        with RacerTable._meta.database.atomic():
+            for batch in chunked(race_rows(race), batch_size):
+                RacerTable.insert_many(batch, fields=RACER_FIELDS).execute()
+                racers += len(batch)
+            ReportTable.insert_from(ranked_places(), [ReportTable.abbreviation, ReportTable.place]).execute()
+            index_racers()
+            bump_data_version()
     except IntegrityError:
-        pass
+        return 0
+    if notify:
+        data_changed()
+    elapsed = time.perf_counter() - started
+    rows = racers * 2
+    app.logger.info('Ingested %d rows in %.3fs (%.0f rows/s)', rows, elapsed, rows / elapsed if elapsed else rows)
+    return racers
+
+
+def data_changed():
+    """
+    Called after every write to the racers and the report. Clears this process's response cache and wakes the event
+    broadcaster; other processes notice the write through the data version committed with it.
+    """
+    report_cache.invalidate()
+    report_events.notify()
+
+
+@app.cli.command('follow')
+@click.option('--start', 'start_path', default='files/start.log', show_default=True)
+@click.option('--end', 'finish_path', default='files/end.log', show_default=True)
+@click.option('--abbreviations', 'abbreviations_path', default='files/abbreviations.txt', show_default=True)
+@click.option('--interval', default=FOLLOW_INTERVAL, show_default=True, help='Seconds between polls of the logs.')
+def follow_command(start_path, finish_path, abbreviations_path, interval):
+    """Follows the logs of a live session and keeps the report up to date."""
+    create_tables()
+    follower = LogFollower(start_path, finish_path, abbreviations_path, on_change=data_changed)
+    while True:
+        updated_racers = follower.poll()
+        if updated_racers:
+            click.echo(f'Updated {len(updated_racers)} racers: {", ".join(updated_racers)}')
+        time.sleep(interval)
+
+
+@app.cli.command('ingest-race')
+@click.argument('race_name')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--season', type=int, help='Season of the race, the year it started if omitted.')
+def ingest_race_command(race_name, directory, season):
+    """Stores the race with the start.log, end.log and abbreviations.txt in DIRECTORY."""
+    create_tables()
+    racers = race_to_db(race_name, os.path.join(directory, 'start.log'), os.path.join(directory, 'end.log'),
+                        os.path.join(directory, 'abbreviations.txt'), season)
+    if racers:
+        data_changed()
+        click.echo(f'Stored {racers} racers of {race_name}')
+    else:
+        click.echo(f'{race_name} is already stored')
+
+
+@app.cli.command('ingest-races')
+@click.argument('root', type=click.Path(exists=True, file_okay=False))
+@click.option('--workers', type=click.IntRange(min=1), help='Parser processes, the number of CPUs if omitted.')
+@click.option('--races-per-commit', type=click.IntRange(min=1), default=RACES_PER_COMMIT, show_default=True)
+def ingest_races_command(root, workers, races_per_commit):
+    """Backfills every race directory under ROOT, parsing them in parallel."""
+    create_tables()
+    started = time.perf_counter()
+
+    def progress(done, total, race_name, racers):
+        click.echo(f'[{done}/{total}] {race_name}: ' + (f'{racers} racers' if racers else 'already stored'))
+
+    racers = ingest_race_directories(root, workers, races_per_commit, progress)
+    if racers:
+        data_changed()
+    click.echo(f'Stored {racers} racers in {time.perf_counter() - started:.2f}s')
+
+
+def ranked_places():
+    """
+    Query returning (abbreviation, place) for every racer: finished racers are numbered by integer lap time, racers
+    without a lap time get no place.
+    """
+    finished = RacerTable.lap_time_ms.is_null(False)
+    place = fn.ROW_NUMBER().over(partition_by=[finished],
+                                 order_by=[RacerTable.lap_time_ms, RacerTable.abbreviation])
+    return RacerTable.select(RacerTable.abbreviation, Case(None, [(finished, place)], None))
 
 
 class Report(Resource):
@@ -55,14 +335,58 @@ class Report(Resource):
             in: query
             type: string
             required: false
-            description: format of data (xml or json)
+            description: format of data (json, xml, ndjson, csv or msgpack), negotiated from Accept if omitted
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            description: maximum number of racers in a page, enables cursor pagination
+          - name: cursor
+            in: query
+            type: string
+            required: false
+            description: cursor of the next page (from the X-Next-Cursor header)
+          - name: team
+            in: query
+            type: string
+            required: false
+            description: only racers of the team
+          - name: place_from
+            in: query
+            type: integer
+            required: false
+            description: lowest place to include
+          - name: place_to
+            in: query
+            type: integer
+            required: false
+            description: highest place to include
+          - name: status
+            in: query
+            type: string
+            required: false
+            description: only finished racers or only racers who did not finish (finished or dnf)
+          - name: race
+            in: query
+            type: string
+            required: false
+            description: name of a stored race, the current race if omitted
+          - name: stream
+            in: query
+            type: boolean
+            required: false
+            description: stream the report as it is read from the database (not combined with limit)
         responses:
           200:
             description: Racers report
+          400:
+            description: Invalid pagination or filter parameter
+          406:
+            description: The requested format is not available
         """
-        args = request.args
-        prepared_info_for_report = info_for_output(args.get("order"))
-        return generate_output_data(prepared_info_for_report, args.get("format"))
+        if wants_stream(request.args):
+            return stream_report_response()
+        return cached_response('report', build_report_response)
 
 
 class Drivers(Resource):
@@ -80,54 +404,546 @@ class Drivers(Resource):
             in: query
             type: string
             required: false
-            description: format of data (xml or json)
+            description: format of data (json, xml, ndjson, csv or msgpack), negotiated from Accept if omitted
           - name: abbreviation
             in: query
             type: string
             required: false
-            description: abbreviation of the racer (SVF for example)
+            description: abbreviation of the racer (SVF for example), or several separated by commas (SVF,LHM)
+          - name: search
+            in: query
+            type: string
+            required: false
+            description: full-text search of racers by name or team, words are matched as prefixes, best match first
+          - name: limit
+            in: query
+            type: integer
+            required: false
+            description: maximum number of racers in a page, enables cursor pagination
+          - name: cursor
+            in: query
+            type: string
+            required: false
+            description: cursor of the next page (from the X-Next-Cursor header)
+          - name: team
+            in: query
+            type: string
+            required: false
+            description: only racers of the team
+          - name: place_from
+            in: query
+            type: integer
+            required: false
+            description: lowest place to include
+          - name: place_to
+            in: query
+            type: integer
+            required: false
+            description: highest place to include
+          - name: status
+            in: query
+            type: string
+            required: false
+            description: only finished racers or only racers who did not finish (finished or dnf)
+          - name: race
+            in: query
+            type: string
+            required: false
+            description: name of a stored race, the current race if omitted (not combined with search)
+          - name: stream
+            in: query
+            type: boolean
+            required: false
+            description: stream the report as it is read from the database (not combined with limit)
         responses:
           200:
             description: Racers report
+          400:
+            description: Invalid pagination, filter or search parameter
+          404:
+            description: None of the racers was found
+          406:
+            description: The requested format is not available
         """
         args = request.args
-        if args.get("abbreviation"):
-            racer = RacerTable.get(RacerTable.abbreviation == args.get("abbreviation"))
-            info_about_racer = {racer.name: {'name': racer.name,
-                                             'team': racer.team,
-                                             'lap_time': racer.lap_time.strftime("%-M:%S:%f")[:-3]
-                                             if racer.lap_time else None}}
-            return generate_output_data(info_about_racer, args.get("format"))
-        prepared_info_for_report = info_for_output(args.get("order"))
-        return generate_output_data(prepared_info_for_report, args.get("format"))
+        if wants_stream(args) and not args.get("abbreviation") and args.get("search") is None:
+            return stream_report_response()
+        return cached_response('drivers', build_drivers_response)
+
+
+def build_report_response():
+    args = request.args
+    filters = report_filters(args)
+    if args.get("limit") is None:
+        prepared_info_for_report = info_for_output(args.get("order"), **filters)
+        return generate_output_data(prepared_info_for_report, output_format())
+    limit = positive_int_arg(args, "limit")
+    if limit > MAX_PAGE_SIZE:
+        abort(400, message=f'limit must not exceed {MAX_PAGE_SIZE}')
+    rows = report_page(args.get("order"), limit + 1, decode_cursor(args.get("cursor")), **filters)
+    response = generate_output_data(rows_for_output(rows[:limit]), output_format())
+    if len(rows) > limit:
+        abbreviation, place = rows[limit - 1][:2]
+        next_cursor = encode_cursor(place, abbreviation)
+        next_args = dict(args.items())
+        next_args["cursor"] = next_cursor
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(next_args)}>; rel="next"'
+    return response
+
+
+def wants_stream(args):
+    return args.get("stream") in ('1', 'true') and args.get("limit") is None
+
+
+def stream_report_response():
+    """
+    Streams the report straight from the database cursor. Streamed responses bypass report_cache, since their body
+    is never held in memory as a whole.
+    """
+    args = request.args
+    rows = stream_rows(report_query(args.get("order"), **report_filters(args)))
+    return stream_output_data((racer_info(*row) for row in rows), output_format())
+
+
+def stream_rows(query):
+    """Iterates the query's cursor on a connection held by the generator, which outlives the request teardown."""
+    database = RacerTable._meta.database
+    opened = database.connect(reuse_if_open=True)
+    try:
+        yield from query.iterator()
+    finally:
+        if opened:
+            database.close()
+
+
+def report_filters(args):
+    """Validates the report filters of the query string."""
+    status = args.get("status")
+    if status not in (None, 'finished', 'dnf'):
+        abort(400, message='status must be "finished" or "dnf"')
+    return {'team': args.get("team"),
+            'place_from': positive_int_arg(args, "place_from"),
+            'place_to': positive_int_arg(args, "place_to"),
+            'status': status,
+            'race': race_id(args.get("race"))}
+
+
+def race_id(race_name):
+    if race_name is None:
+        return None
+    race = RaceTable.get_or_none(RaceTable.name == race_name)
+    if race is None:
+        abort(404, message=f'race {race_name} not found')
+    return race.id
+
+
+def positive_int_arg(args, name):
+    value = args.get(name)
+    if value is None:
+        return None
+    if not (value.isascii() and value.isdigit()) or int(value) < 1:
+        abort(400, message=f'{name} must be a positive integer')
+    return int(value)
+
+
+def encode_cursor(place, abbreviation):
+    return base64.urlsafe_b64encode(json.dumps([place, abbreviation]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the (place, abbreviation) key encoded in the cursor, or None for the first page."""
+    if not cursor:
+        return None
+    try:
+        place, abbreviation = json.loads(base64.urlsafe_b64decode(cursor.encode() + b'=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError, binascii.Error):
+        abort(400, message='invalid cursor')
+    if not isinstance(abbreviation, str) or not (place is None or isinstance(place, int)):
+        abort(400, message='invalid cursor')
+    return place, abbreviation
+
+
+def build_drivers_response():
+    args = request.args
+    if args.get("abbreviation"):
+        abbreviations = [abbreviation.strip() for abbreviation in args.get("abbreviation").split(',')
+                         if abbreviation.strip()]
+        query, abbreviation_field = drivers_query(race_id(args.get("race")))
+        racers = {abbreviation: (name, team, lap_time_ms) for abbreviation, name, team, lap_time_ms
+                  in query.where(abbreviation_field.in_(abbreviations))}
+        if not racers:
+            abort(404, message=f'racer {args.get("abbreviation")} not found')
+        rows = [racers[abbreviation] for abbreviation in dict.fromkeys(abbreviations) if abbreviation in racers]
+        return generate_output_data(drivers_info(rows), output_format())
+    if args.get("search") is not None:
+        if args.get("race") is not None:
+            abort(400, message='search is only available for the current race')
+        terms = re.findall(r'\w+', args.get("search"))
+        if not terms:
+            abort(400, message='search must contain a word')
+        rows = (RacerTable
+                .select(RacerTable.abbreviation, ReportTable.place, RacerTable.name, RacerTable.team,
+                        RacerTable.lap_time_ms)
+                .join(RacerSearchIndex, on=(RacerSearchIndex.abbreviation == RacerTable.abbreviation))
+                .join_from(RacerTable, ReportTable, JOIN.LEFT_OUTER)
+                .where(RacerSearchIndex.match(' '.join(f'"{term}"*' for term in terms)))
+                .order_by(RacerSearchIndex.bm25(), RacerTable.abbreviation)
+                .tuples())
+        return generate_output_data(rows_for_output(rows), output_format())
+    return build_report_response()
+
+
+def drivers_query(race=None):
+    """
+    Query returning (abbreviation, name, team, lap_time_ms) of the current race's racers, or of the stored race with
+    the id race, with the abbreviation field to filter it on.
+    """
+    if race is None:
+        return (RacerTable
+                .select(RacerTable.abbreviation, RacerTable.name, RacerTable.team, RacerTable.lap_time_ms)
+                .tuples(), RacerTable.abbreviation)
+    return (RaceResultTable
+            .select(RaceResultTable.abbreviation, RaceResultTable.name, RaceResultTable.team,
+                    RaceResultTable.lap_time_ms)
+            .where(RaceResultTable.race == race)
+            .tuples(), RaceResultTable.abbreviation)
+
+
+def drivers_info(rows):
+    """Drivers keyed by name, from (name, team, lap_time_ms) rows."""
+    return {name: {'name': name,
+                   'team': team,
+                   'lap_time': format_lap_time(lap_time_ms) if lap_time_ms is not None else None}
+            for name, team, lap_time_ms in rows}
+
+
+def cached_response(endpoint, build_response):
+    """
+    Serves a fully serialized response from report_cache, building it on a miss. The cache key covers the endpoint,
+    the negotiated output format and every query argument (order, abbreviation, ...); the entry's ETag answers
+    If-None-Match with 304. Bodies are compressed according to Accept-Encoding, once per cache entry. The data version
+    is read from the database first, so writes committed by other processes (flask follow, ingest-race) invalidate
+    the cache as well.
+    """
+    key = (endpoint, output_format()) + tuple(sorted(request.args.items(multi=True)))
+    version = report_cache.sync(current_data_version())
+    entry = report_cache.get(version, key)
+    if entry is None:
+        with phase_timer('build'):
+            built_response = build_response()
+        headers = [(name, value) for name, value in built_response.headers if name in CACHED_HEADERS]
+        entry = report_cache.put(version, key, built_response.get_data(), built_response.mimetype, headers)
+    encoding = request.accept_encodings.best_match(list(COMPRESSORS))
+    if encoding and len(entry.body) >= COMPRESSION_MIN_SIZE:
+        with phase_timer('compress'):
+            body = encoded_body(entry, encoding)
+        response = Response(body, mimetype=entry.mimetype, headers=list(entry.headers))
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f'{entry.etag}-{encoding}')
+    else:
+        response = Response(entry.body, mimetype=entry.mimetype, headers=list(entry.headers))
+        response.set_etag(entry.etag)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response.make_conditional(request)
+
+
+def output_format():
+    """
+    The format query parameter or, when it is omitted, another format only if the Accept header prefers it over JSON.
+    Browsers accept text/html first, which counts as JSON.
+    """
+    format_for_output = request.args.get("format")
+    if format_for_output is None:
+        accept = request.accept_mimetypes
+        json_quality = max(accept.quality('application/json'), accept.quality('text/html'))
+        qualities = ((name, accept.quality(mimetype)) for name, mimetype in OUTPUT_MIMETYPES.items())
+        format_for_output, quality = max(qualities, key=lambda item: item[1])
+        if quality <= json_quality:
+            format_for_output = 'json'
+    return format_for_output
 
 
 def generate_output_data(info_for_api, format_for_output):
+    with phase_timer('serialize'):
+        return serialize_output_data(info_for_api, format_for_output)
+
+
+def serialize_output_data(info_for_api, format_for_output):
     if format_for_output == 'xml':
         return Response(dict2xml(info_for_api, wrap="racers", indent="  "), mimetype='application/xml')
+    elif format_for_output == 'ndjson':
+        return Response(''.join(ndjson_chunks(output_items(info_for_api), STREAM_CHUNK_SIZE)),
+                        mimetype=OUTPUT_MIMETYPES['ndjson'])
+    elif format_for_output == 'csv':
+        return Response(''.join(csv_chunks(output_items(info_for_api), STREAM_CHUNK_SIZE)),
+                        mimetype=OUTPUT_MIMETYPES['csv'])
+    elif format_for_output == 'msgpack':
+        if msgpack is None:
+            abort(406, message='msgpack output requires the msgpack package')
+        return Response(msgpack.packb(info_for_api), mimetype=OUTPUT_MIMETYPES['msgpack'])
     else:
         return jsonify(info_for_api)
 
 
-def info_for_output(ordering):
-    query_for_valid_racers = ReportTable.select().join(RacerTable).where(RacerTable.lap_time != None)
-    if ordering == 'desc':
-        query_for_valid_racers = query_for_valid_racers.order_by(ReportTable.place.desc())
-    query_for_other_racers = ReportTable.select().join(RacerTable).where(RacerTable.lap_time == None)
+def output_items(info_for_api):
+    """Report items as a list of {name: fields} dicts, also for the single driver dict."""
+    if isinstance(info_for_api, dict):
+        return [{name: fields} for name, fields in info_for_api.items()]
+    return info_for_api
+
+
+def stream_output_data(info_for_api, format_for_output, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streaming counterpart of generate_output_data: info_for_api is consumed lazily and sent in chunks of chunk_size
+    racers, the concatenated chunks are byte-identical to the buffered output.
+    """
+    if format_for_output == 'xml':
+        chunks = xml_chunks(info_for_api, chunk_size)
+        mimetype = 'application/xml'
+    elif format_for_output in ('ndjson', 'csv'):
+        chunks = (ndjson_chunks if format_for_output == 'ndjson' else csv_chunks)(info_for_api, chunk_size)
+        mimetype = OUTPUT_MIMETYPES[format_for_output]
+    elif format_for_output == 'msgpack':
+        return generate_output_data(list(info_for_api), format_for_output)
+    else:
+        chunks = json_chunks(info_for_api, chunk_size)
+        mimetype = 'application/json'
+    return Response(stream_with_context(chunks), mimetype=mimetype)
+
+
+def json_chunks(info_for_api, chunk_size):
+    compact = app.json.compact
+    if compact or (compact is None and not app.debug):
+        dump_args, separator, closing = {'separators': (",", ":")}, ',', ']'
+    else:
+        dump_args, separator, closing = {'indent': 2}, ',\n  ', '\n]'
+    empty = True
+    for batch in chunked(info_for_api, chunk_size):
+        elements = [app.json.dumps(racer, **dump_args).replace('\n', '\n  ') for racer in batch]
+        if empty:
+            yield ('[' if 'separators' in dump_args else '[\n  ') + separator.join(elements)
+            empty = False
+        else:
+            yield separator + separator.join(elements)
+    yield '[]\n' if empty else closing + '\n'
+
+
+def xml_chunks(info_for_api, chunk_size):
+    empty = True
+    for batch in chunked(info_for_api, chunk_size):
+        elements = '\n'.join(dict2xml(racer, wrap="racers", indent="  ") for racer in batch)
+        yield elements if empty else '\n' + elements
+        empty = False
+    if empty:
+        yield dict2xml([], wrap="racers", indent="  ")
+
+
+def ndjson_chunks(info_for_api, chunk_size):
+    for batch in chunked(info_for_api, chunk_size):
+        yield ''.join(app.json.dumps(racer, separators=(",", ":")) + '\n' for racer in batch)
+
+
+def csv_chunks(info_for_api, chunk_size):
+    buffer = io.StringIO()
+    writer = None
+    for batch in chunked(info_for_api, chunk_size):
+        for racer in batch:
+            fields = next(iter(racer.values()))
+            if writer is None:
+                writer = csv.DictWriter(buffer, [field for field in CSV_FIELDS if field in fields],
+                                        extrasaction='ignore')
+                writer.writeheader()
+            writer.writerow(fields)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def info_for_output(ordering, **filters):
+    """
+    Builds the report with a single joined query. Finished racers come first ordered by place, racers without a place
+    (DNF) are placed last.
+    """
+    return rows_for_output(report_query(ordering, **filters))
+
+
+def report_query(ordering, team=None, place_from=None, place_to=None, status=None, race=None):
+    """
+    Joined report query returning (abbreviation, place, name, team, lap_time_ms) tuples, of the current race or of
+    the stored race with the id race. The filters are pushed down into SQL.
+    """
+    query, place_field, abbreviation_field = filtered_report_query(team, place_from, place_to, race)
+    place_ordering = place_field.desc(nulls='LAST') if ordering == 'desc' else place_field.asc(nulls='LAST')
+    if status == 'finished':
+        query = query.where(place_field.is_null(False))
+    elif status == 'dnf':
+        query = query.where(place_field.is_null())
+    return query.order_by(place_ordering, abbreviation_field)
+
+
+def report_page(ordering, limit, after=None, team=None, place_from=None, place_to=None, status=None, race=None):
+    """
+    Up to limit report rows following after, a (place, abbreviation) key, finished racers first, then the racers
+    without a place by abbreviation.
+    """
+    query, place_field, abbreviation_field = filtered_report_query(team, place_from, place_to, race)
+    rows = []
+    if status != 'dnf' and (after is None or after[0] is not None):
+        finished = query.where(place_field.is_null(False))
+        key = Tuple(place_field, abbreviation_field)
+        if ordering == 'desc':
+            if after is not None:
+                finished = finished.where(key < Tuple(*after))
+            finished = finished.order_by(place_field.desc(), abbreviation_field.desc())
+        else:
+            if after is not None:
+                finished = finished.where(key > Tuple(*after))
+            finished = finished.order_by(place_field, abbreviation_field)
+        rows = list(finished.limit(limit))
+    if status != 'finished' and len(rows) < limit:
+        unplaced = query.where(place_field.is_null())
+        if after is not None and after[0] is None:
+            unplaced = unplaced.where(abbreviation_field > after[1])
+        rows += list(unplaced.order_by(abbreviation_field).limit(limit - len(rows)))
+    return rows
+
+
+def filtered_report_query(team, place_from, place_to, race):
+    """The unordered report query with the team and place filters, with its place and abbreviation fields."""
+    if race is None:
+        place_field, abbreviation_field, team_field = ReportTable.place, ReportTable.abbreviation, RacerTable.team
+        query = (ReportTable
+                 .select(ReportTable.abbreviation, ReportTable.place, RacerTable.name, RacerTable.team,
+                         RacerTable.lap_time_ms)
+                 .join(RacerTable))
+    else:
+        place_field, abbreviation_field, team_field = (RaceResultTable.place, RaceResultTable.abbreviation,
+                                                       RaceResultTable.team)
+        query = (RaceResultTable
+                 .select(RaceResultTable.abbreviation, RaceResultTable.place, RaceResultTable.name,
+                         RaceResultTable.team, RaceResultTable.lap_time_ms)
+                 .where(RaceResultTable.race == race))
+    if team is not None:
+        query = query.where(team_field == team)
+    if place_from is not None:
+        query = query.where(place_field >= place_from)
+    if place_to is not None:
+        query = query.where(place_field <= place_to)
+    return query.tuples(), place_field, abbreviation_field
+
+
+def rows_for_output(rows):
+    info_for_api = [racer_info(*row) for row in rows]
+    return info_for_api
+
+
+def racer_info(abbreviation, place, name, team, lap_time_ms):
+    return {name: {'place': place,
+                   'name': name,
+                   'team': team,
+                   'lap_time': format_lap_time(lap_time_ms)}}
+
+
+class ReportEvents(Resource):
+    def get(self):
+        """
+        Example endpoint streaming the changes of the report as Server-Sent Events, instead of polling the report.
+        The first event, snapshot, holds every racer of the report. Each following diff event lists the racers who
+        finished, the racers whose place moved (with previous_place), the other new or changed racers (updated) and
+        the removed abbreviations.
+        ---
+        produces:
+          - text/event-stream
+        responses:
+          200:
+            description: Stream of snapshot and diff events
+        """
+        subscriber = report_events.subscribe()
+        response = Response(report_events.stream(subscriber), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def report_snapshot():
+    """The report as {abbreviation: racer}, the state the report events are computed from."""
+    rows = (ReportTable
+            .select(ReportTable.abbreviation, ReportTable.place, RacerTable.name, RacerTable.team,
+                    RacerTable.lap_time_ms)
+            .join(RacerTable)
+            .order_by(ReportTable.place.asc(nulls='LAST'), ReportTable.abbreviation)
+            .tuples())
+    return {abbreviation: {'abbreviation': abbreviation, 'place': place, 'name': name, 'team': team,
+                           'lap_time': format_lap_time(lap_time_ms)}
+            for abbreviation, place, name, team, lap_time_ms in rows}
+
+
+def data_version():
+    """
+    SQLite's data_version on the calling thread's connection, which is kept open: it changes whenever another
+    connection, in this or another process, commits a write.
+    """
+    database = RacerTable._meta.database
+    database.connect(reuse_if_open=True)
+    return database.execute_sql('PRAGMA data_version').fetchone()[0]
+
+
+report_events = ReportBroadcaster(report_snapshot, data_version)
+
+
+class Standings(Resource):
+    def get(self):
+        """
+        Example endpoint returning the precomputed season standings of the F1 racers.
+        ---
+        parameters:
+          - name: season
+            in: query
+            type: integer
+            required: false
+            description: season of the standings, the latest stored season if omitted
+          - name: format
+            in: query
+            type: string
+            required: false
+            description: format of data (json, xml, ndjson, csv or msgpack), negotiated from Accept if omitted
+        responses:
+          200:
+            description: Season standings
+          400:
+            description: Invalid season
+        """
+        return cached_response('standings', build_standings_response)
+
+
+def build_standings_response():
+    args = request.args
+    season = positive_int_arg(args, "season") or latest_season()
     info_for_api = [
-        {racer.abbreviation.name: {'place': racer.place,
-                                   'name': racer.abbreviation.name,
-                                   'team': racer.abbreviation.team,
-                                   'lap_time': racer.abbreviation.lap_time_str()}}
-        for racer in chain(query_for_valid_racers, query_for_other_racers)
+        {name: {'position': position,
+                'name': name,
+                'team': team,
+                'points': points,
+                'races': races,
+                'wins': wins}}
+        for position, (abbreviation, name, team, points, races, wins, best_place)
+        in enumerate(standings_query(season), start=1)
     ]
-    return info_for_api
+    return generate_output_data(info_for_api, output_format())
+
+
+def register_resources(api):
+    api.add_resource(Report, '/api/v1/report/')
+    api.add_resource(Drivers, '/api/v1/report/drivers/')
+    api.add_resource(ReportEvents, '/api/v1/report/events/')
+    api.add_resource(Standings, '/api/v1/standings/')
 
 
-api.add_resource(Report, '/api/v1/report/')
-api.add_resource(Drivers, '/api/v1/report/drivers/')
+register_resources(api)
 
 if __name__ == '__main__':
+    app.logger.setLevel(logging.INFO)
     create_tables()
-    from_files_to_db('files/start.log', 'files/end.log', 'files/abbreviations.txt')
+    load_source_files('files/start.log', 'files/end.log', 'files/abbreviations.txt')
     app.run(debug=True)
@@ -0,0 +1,80 @@
+from bisect import bisect_left
+from threading import Lock
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms with labels, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name, help_text):
+        self._counters[name] = (help_text, {})
+
+    def histogram(self, name, help_text, buckets):
+        self._histograms[name] = (help_text, tuple(buckets), {})
+
+    def inc(self, name, labels, amount=1):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._counters[name][1]
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            help_text, buckets, histograms = self._histograms[name]
+            if key not in histograms:
+                histograms[key] = Histogram(buckets)
+            histograms[key].observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, values) in sorted(self._counters.items()):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                lines += [f'{name}{format_labels(key)} {format_value(value)}' for key, value in sorted(values.items())]
+            for name, (help_text, buckets, histograms) in sorted(self._histograms.items()):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for key, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bucket, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(key + (("le", format_value(bucket)),))} '
+                                     f'{cumulative}')
+                    lines.append(f'{name}_sum{format_labels(key)} {format_value(histogram.sum)}')
+                    lines.append(f'{name}_count{format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(key):
+    if not key:
+        return ''
+    labels = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                      for name, value in key)
+    return '{' + labels + '}'
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
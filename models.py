@@ -1,8 +1,95 @@
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
+from playhouse.sqlite_ext import FTS5Model, SearchField
 import datetime
+import json
+import os
+import time
 
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'database.db')
+DATABASE_POOLED = os.environ.get('DATABASE_POOLED', '') in ('1', 'true')
+DATABASE_MAX_CONNECTIONS = int(os.environ.get('DATABASE_MAX_CONNECTIONS', 8))
+DEFAULT_PRAGMAS = {'journal_mode': 'wal',
+                   'synchronous': 'normal',
+                   'cache_size': -64000,
+                   'mmap_size': 268435456}
 
-db = SqliteDatabase('database.db')
+db = DatabaseProxy()
+query_listeners = []
+
+
+class QueryTimingMixin:
+    """Reports every statement the database executes, with its duration in seconds, to the query_listeners."""
+
+    def execute_sql(self, sql, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            for listener in query_listeners:
+                listener(sql, elapsed)
+
+
+class TimedSqliteDatabase(QueryTimingMixin, SqliteDatabase):
+    pass
+
+
+class TimedPooledSqliteDatabase(QueryTimingMixin, PooledSqliteDatabase):
+    pass
+
+
+def configured_pragmas():
+    """
+    DEFAULT_PRAGMAS updated with the DATABASE_PRAGMAS environment variable, a JSON object such as
+    {"cache_size": -128000}. A null value drops the pragma.
+    """
+    pragmas = dict(DEFAULT_PRAGMAS, **json.loads(os.environ.get('DATABASE_PRAGMAS', '{}')))
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def create_database(path, pragmas=None, pooled=False, **kwargs):
+    """
+    Creates the SQLite database for path. pragmas default to configured_pragmas(): in WAL journal mode report reads are
+    not blocked by an ingest transaction. With pooled=True the connections come from a PooledSqliteDatabase, kwargs
+    (max_connections, stale_timeout, ...) are passed on to the database class. Executed statements are reported to
+    the query_listeners.
+    """
+    pragmas = configured_pragmas() if pragmas is None else pragmas
+    if pooled:
+        return TimedPooledSqliteDatabase(path, pragmas=pragmas, **kwargs)
+    return TimedSqliteDatabase(path, pragmas=pragmas, **kwargs)
+
+
+def init_database(path=DATABASE_PATH, pragmas=None, pooled=DATABASE_POOLED, **kwargs):
+    """Points db, the database of all models, at a database created by create_database."""
+    if pooled:
+        kwargs.setdefault('max_connections', DATABASE_MAX_CONNECTIONS)
+    database = create_database(path, pragmas, pooled, **kwargs)
+    db.initialize(database)
+    return database
+
+
+init_database()
+
+
+def lap_time_to_ms(lap_time):
+    """Converts a lap time (datetime.time or datetime.timedelta) to whole milliseconds."""
+    if lap_time is None:
+        return None
+    if isinstance(lap_time, datetime.timedelta):
+        return lap_time // datetime.timedelta(milliseconds=1)
+    return ((lap_time.hour * 60 + lap_time.minute) * 60 + lap_time.second) * 1000 + lap_time.microsecond // 1000
+
+
+def format_lap_time(lap_time_ms):
+    """Formats milliseconds as M:SS:mmm, the layout used in the report."""
+    if lap_time_ms is None:
+        return '-'
+    minutes, milliseconds = divmod(lap_time_ms, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return '%d:%02d:%03d' % (minutes, seconds, milliseconds)
 
 
 class BaseModel(Model):
@@ -13,16 +100,21 @@ class BaseModel(Model):
 class RacerTable(BaseModel):
     abbreviation = CharField(unique=True, primary_key=True)
     name = CharField()
-    team = CharField()
+    team = CharField(index=True)
     start_time = DateTimeField()
     finish_time = DateTimeField()
     lap_time = TimeField(null=True)
+    lap_time_ms = IntegerField(null=True, index=True)
 
     class Meta:
         db_table = 'Racers'
 
+    def save(self, *args, **kwargs):
+        self.lap_time_ms = lap_time_to_ms(self.lap_time)
+        return super().save(*args, **kwargs)
+
     def lap_time_str(self):
-        return self.lap_time.strftime("%-M:%S:%f")[:-3] if self.lap_time else '-'
+        return format_lap_time(self.lap_time_ms)
 
 
 class ReportTable(BaseModel):
@@ -31,3 +123,153 @@ class ReportTable(BaseModel):
 
     class Meta:
         db_table = 'Report'
+        indexes = (
+            (('place', 'abbreviation'), False),
+        )
+
+
+class RacerSearchIndex(FTS5Model):
+    abbreviation = SearchField(unindexed=True)
+    name = SearchField()
+    team = SearchField()
+
+    class Meta:
+        database = db
+        db_table = 'RacerSearch'
+        options = {'prefix': '2 3'}
+
+
+def index_racers(abbreviations=None):
+    """Rebuilds the full-text index entries of the racers with the abbreviations, or of all racers if None."""
+    delete = RacerSearchIndex.delete()
+    racers = RacerTable.select(RacerTable.abbreviation, RacerTable.name, RacerTable.team)
+    if abbreviations is not None:
+        delete = delete.where(RacerSearchIndex.abbreviation.in_(abbreviations))
+        racers = racers.where(RacerTable.abbreviation.in_(abbreviations))
+    delete.execute()
+    RacerSearchIndex.insert_from(racers, [RacerSearchIndex.abbreviation, RacerSearchIndex.name,
+                                          RacerSearchIndex.team]).execute()
+
+
+class SourceFileTable(BaseModel):
+    path = CharField(primary_key=True)
+    size = IntegerField()
+    mtime_ns = IntegerField()
+    sha256 = CharField()
+
+    class Meta:
+        db_table = 'SourceFiles'
+
+
+class DataVersionTable(BaseModel):
+    version = IntegerField(default=0)
+
+    class Meta:
+        db_table = 'DataVersion'
+
+
+def bump_data_version():
+    """
+    Increments the data version shared by every process using the database. Called inside the transactions that
+    write the racers, the report, the races or the standings, so the new version commits together with the data.
+    """
+    (DataVersionTable
+     .insert(id=1, version=1)
+     .on_conflict(conflict_target=[DataVersionTable.id],
+                  update={DataVersionTable.version: DataVersionTable.version + 1})
+     .execute())
+
+
+def current_data_version():
+    return DataVersionTable.select(DataVersionTable.version).where(DataVersionTable.id == 1).scalar() or 0
+
+
+class RaceTable(BaseModel):
+    name = CharField(unique=True)
+    season = IntegerField(index=True)
+
+    class Meta:
+        db_table = 'Races'
+
+
+class RaceResultTable(BaseModel):
+    race = ForeignKeyField(RaceTable, backref='results', on_delete='CASCADE')
+    abbreviation = CharField()
+    name = CharField()
+    team = CharField(index=True)
+    start_time = DateTimeField()
+    finish_time = DateTimeField()
+    lap_time_ms = IntegerField(null=True)
+    place = IntegerField(null=True)
+
+    class Meta:
+        db_table = 'RaceResults'
+        indexes = (
+            (('race', 'abbreviation'), True),
+            (('race', 'place', 'abbreviation'), False),
+        )
+
+
+class StandingTable(BaseModel):
+    season = IntegerField()
+    abbreviation = CharField()
+    name = CharField()
+    team = CharField()
+    points = IntegerField(default=0)
+    races = IntegerField(default=0)
+    wins = IntegerField(default=0)
+    best_place = IntegerField(null=True)
+
+    class Meta:
+        db_table = 'Standings'
+        primary_key = CompositeKey('season', 'abbreviation')
+        indexes = (
+            (('season', 'points'), False),
+        )
+
+
+def model_database(model):
+    """The database the model is bound to, resolving db to the database it points at."""
+    database = model._meta.database
+    if isinstance(database, DatabaseProxy):
+        database = database.obj
+    return database
+
+
+def migrate_columns():
+    """
+    Adds and backfills the lap_time_ms column of a Racers table created before lap times were stored as integer
+    milliseconds. Must run before the tables and their indexes are created: an index on the missing column would
+    index a constant and leave the file malformed.
+    """
+    database = model_database(RacerTable)
+    if not database.table_exists(RacerTable._meta.table_name):
+        return
+    columns = [column.name for column in database.get_columns(RacerTable._meta.table_name)]
+    if 'lap_time_ms' in columns:
+        return
+    with database.atomic():
+        migrate(SqliteMigrator(database).add_column(RacerTable._meta.table_name, 'lap_time_ms',
+                                                    IntegerField(null=True)))
+        racers = RacerTable.select(RacerTable.abbreviation, RacerTable.lap_time).where(RacerTable.lap_time != None)
+        for abbreviation, lap_time in racers.tuples():
+            (RacerTable
+             .update(lap_time_ms=lap_time_to_ms(lap_time))
+             .where(RacerTable.abbreviation == abbreviation)
+             .execute())
+
+
+def migrate_schema():
+    """
+    Brings database files created by older versions up to date: migrates the columns, creates the indexes missing
+    from older tables and fills an empty full-text index.
+    """
+    migrate_columns()
+    database = model_database(RacerTable)
+    with database.atomic():
+        RacerTable._schema.create_indexes(safe=True)
+        ReportTable._schema.create_indexes(safe=True)
+        if database.table_exists(RaceResultTable._meta.table_name):
+            RaceResultTable._schema.create_indexes(safe=True)
+        if database.table_exists(RacerSearchIndex._meta.table_name) and not RacerSearchIndex.select().exists():
+            index_racers()
@@ -0,0 +1,136 @@
+from models import RaceTable, RaceResultTable, StandingTable, bump_data_version
+from log_parser import read_race, race_rows
+from peewee import IntegrityError, EXCLUDED, chunked, fn
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+
+POINTS = (25, 18, 15, 12, 10, 8, 6, 4, 2, 1)
+RESULT_BATCH_SIZE = 100
+RACES_PER_COMMIT = 20
+RACE_FILES = ('start.log', 'end.log', 'abbreviations.txt')
+
+
+def race_points(place):
+    return POINTS[place - 1] if place is not None and place <= len(POINTS) else 0
+
+
+def race_to_db(race_name, start_path, finish_path, abbreviations_path, season=None, batch_size=RESULT_BATCH_SIZE):
+    """The function transfer a race from its files to its own partition of the race results."""
+    return store_race(race_name, read_race(start_path, finish_path, abbreviations_path), season, batch_size)
+
+
+def store_race(race_name, race, season=None, batch_size=RESULT_BATCH_SIZE):
+    """
+    Stores a parsed race (RaceColumns) as its own partition of the race results and adds its points to the season
+    standings, both in one transaction with the bump of the shared data version. The season defaults to the year the
+    race started. Returns the number of stored racers, 0 when a race with this name was stored before.
+    """
+    rows = sorted(race_rows(race), key=lambda row: (row[6] is None, row[6] or 0, row[0]))
+    if not rows:
+        return 0
+    season = season or rows[0][3].year
+    results = []
+    place = 0
+    for abbreviation, name, team, start_time, finish_time, lap_time, lap_time_ms in rows:
+        if lap_time_ms is not None:
+            place += 1
+        results.append({'abbreviation': abbreviation, 'name': name, 'team': team, 'start_time': start_time,
+                        'finish_time': finish_time, 'lap_time_ms': lap_time_ms,
+                        'place': place if lap_time_ms is not None else None})
+    try:
+        with RaceTable._meta.database.atomic():
+            race_id = RaceTable.insert(name=race_name, season=season).execute()
+            for batch in chunked(results, batch_size):
+                RaceResultTable.insert_many([dict(result, race=race_id) for result in batch]).execute()
+            update_standings(season, results, batch_size)
+            bump_data_version()
+    except IntegrityError:
+        return 0
+    return len(results)
+
+
+def update_standings(season, results, batch_size=RESULT_BATCH_SIZE):
+    """
+    Adds the results of one race to the precomputed season standings with an upsert per racer, so the standings are
+    never recomputed from all the races of the season.
+    """
+    standings = [{'season': season, 'abbreviation': result['abbreviation'], 'name': result['name'],
+                  'team': result['team'], 'points': race_points(result['place']), 'races': 1,
+                  'wins': int(result['place'] == 1), 'best_place': result['place']}
+                 for result in results]
+    for batch in chunked(standings, batch_size):
+        (StandingTable
+         .insert_many(batch)
+         .on_conflict(conflict_target=[StandingTable.season, StandingTable.abbreviation],
+                      update={StandingTable.name: EXCLUDED.name,
+                              StandingTable.team: EXCLUDED.team,
+                              StandingTable.points: StandingTable.points + EXCLUDED.points,
+                              StandingTable.races: StandingTable.races + EXCLUDED.races,
+                              StandingTable.wins: StandingTable.wins + EXCLUDED.wins,
+                              StandingTable.best_place: fn.COALESCE(fn.MIN(StandingTable.best_place,
+                                                                           EXCLUDED.best_place),
+                                                                    StandingTable.best_place, EXCLUDED.best_place)})
+         .execute())
+
+
+def standings_query(season):
+    """Season standings as (abbreviation, name, team, points, races, wins, best_place) tuples, leader first."""
+    return (StandingTable
+            .select(StandingTable.abbreviation, StandingTable.name, StandingTable.team, StandingTable.points,
+                    StandingTable.races, StandingTable.wins, StandingTable.best_place)
+            .where(StandingTable.season == season)
+            .order_by(StandingTable.points.desc(), StandingTable.wins.desc(),
+                      StandingTable.best_place.asc(nulls='LAST'), StandingTable.abbreviation)
+            .tuples())
+
+
+def latest_season():
+    return RaceTable.select(fn.MAX(RaceTable.season)).scalar()
+
+
+def discover_race_directories(root):
+    """Directories under root (root included) holding start.log, end.log and abbreviations.txt, in sorted order."""
+    directories = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        if all(name in files for name in RACE_FILES):
+            directories.append(directory)
+    return directories
+
+
+def parse_race_directory(directory):
+    return directory, read_race(*(os.path.join(directory, name) for name in RACE_FILES))
+
+
+def ingest_race_directories(root, workers=None, races_per_commit=RACES_PER_COMMIT, progress=None):
+    """
+    Backfills every race directory under root. The files are parsed in a pool of workers processes (os.cpu_count()
+    if None, in this process if 1) and the parsed races are funneled to this process, the single writer, which
+    commits them in transactions of races_per_commit races. Races are named by their path relative to root.
+    progress(done, total, race_name, racers) is called after every race. Returns the number of stored racers.
+    """
+    directories = discover_race_directories(root)
+    if workers == 1:
+        parsed_races = map(parse_race_directory, directories)
+        return store_parsed_races(root, parsed_races, len(directories), races_per_commit, progress)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse_race_directory, directory) for directory in directories]
+        parsed_races = (future.result() for future in as_completed(futures))
+        return store_parsed_races(root, parsed_races, len(directories), races_per_commit, progress)
+
+
+def store_parsed_races(root, parsed_races, total, races_per_commit, progress):
+    racers = 0
+    done = 0
+    for batch in chunked(parsed_races, races_per_commit):
+        with RaceTable._meta.database.atomic():
+            for directory, race in batch:
+                race_name = os.path.relpath(directory, root).replace(os.sep, '/')
+                if race_name == '.':
+                    race_name = os.path.basename(os.path.abspath(root))
+                stored_racers = store_race(race_name, race)
+                racers += stored_racers
+                done += 1
+                if progress:
+                    progress(done, total, race_name, stored_racers)
+    return racers
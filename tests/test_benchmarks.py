@@ -0,0 +1,34 @@
+import pytest
+from benchmarks.race_data import write_race, abbreviations, MAX_RACERS
+from benchmarks.run import percentile
+from main import from_files_to_db
+from models import RacerTable, ReportTable
+from tests.test_main import setup_db, tear_down_db
+
+
+def test_write_race(tmp_path):
+    setup_db()
+    paths = write_race(tmp_path, 200, dnf_ratio=0.1, seed=1)
+    contents = [path.read_text() for path in paths]
+    write_race(tmp_path, 200, dnf_ratio=0.1, seed=1)
+    assert [path.read_text() for path in paths] == contents
+    assert from_files_to_db(*paths) == 200
+    did_not_finish = RacerTable.select().where(RacerTable.lap_time_ms.is_null()).count()
+    assert 0 < did_not_finish < 200
+    assert ReportTable.select().where(ReportTable.place.is_null(False)).count() == 200 - did_not_finish
+    tear_down_db()
+
+
+def test_abbreviations():
+    codes = abbreviations(MAX_RACERS)
+    assert len(set(codes)) == MAX_RACERS
+    assert all(len(code) == 3 and '_' not in code for code in codes)
+    with pytest.raises(ValueError):
+        abbreviations(MAX_RACERS + 1)
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 99) == 99
+    assert percentile([3.0], 99) == 3.0
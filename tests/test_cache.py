@@ -0,0 +1,24 @@
+from cache import ResponseCache
+
+
+def test_ResponseCache_lru_eviction():
+    cache = ResponseCache(maxsize=2)
+    cache.put(cache.version, 'first', b'1', 'application/json')
+    cache.put(cache.version, 'second', b'2', 'application/json')
+    assert cache.get(cache.version, 'first').body == b'1'
+    cache.put(cache.version, 'third', b'3', 'application/json')
+    assert cache.get(cache.version, 'second') is None
+    assert cache.get(cache.version, 'first').body == b'1'
+    assert cache.get(cache.version, 'third').body == b'3'
+
+
+def test_ResponseCache_invalidate():
+    cache = ResponseCache()
+    version = cache.version
+    entry = cache.put(version, 'report', b'[]', 'application/json')
+    assert entry.etag
+    cache.invalidate()
+    assert cache.get(version, 'report') is None
+    assert cache.get(cache.version, 'report') is None
+    cache.put(version, 'report', b'[]', 'application/json')
+    assert len(cache) == 0
@@ -0,0 +1,60 @@
+from events import ReportBroadcaster, report_diff
+import json
+
+SNAPSHOT = {'SVF': {'abbreviation': 'SVF', 'place': 1, 'name': 'Sebastian Vettel', 'team': 'FERRARI',
+                    'lap_time': '1:04:415'},
+            'DRR': {'abbreviation': 'DRR', 'place': None, 'name': 'Daniel Ricciardo', 'team': 'RED BULL',
+                    'lap_time': '-'}}
+
+
+def event_data(event):
+    lines = dict(line.split(': ', 1) for line in event.strip().split('\n'))
+    return lines['event'], json.loads(lines['data'])
+
+
+def test_report_diff():
+    lewis = {'abbreviation': 'LHM', 'place': 1, 'name': 'Lewis Hamilton', 'team': 'MERCEDES', 'lap_time': '1:03:000'}
+    current = {'LHM': lewis, 'SVF': dict(SNAPSHOT['SVF'], place=2), 'DRR': dict(SNAPSHOT['DRR'], team='RBR')}
+    assert report_diff(SNAPSHOT, current) == {'finished': [lewis],
+                                              'moved': [{'abbreviation': 'SVF', 'place': 2, 'previous_place': 1}],
+                                              'updated': [current['DRR']],
+                                              'removed': []}
+    assert report_diff(SNAPSHOT, {'SVF': SNAPSHOT['SVF']}) == {'finished': [], 'moved': [], 'updated': [],
+                                                               'removed': ['DRR']}
+    assert report_diff(SNAPSHOT, dict(SNAPSHOT)) is None
+
+
+def test_ReportBroadcaster_fan_out():
+    snapshots = [SNAPSHOT]
+    loads = []
+
+    def load_snapshot():
+        loads.append(1)
+        return snapshots[-1]
+
+    broadcaster = ReportBroadcaster(load_snapshot, interval=3600)
+    subscribers = [broadcaster.subscribe() for _ in range(3)]
+    assert len(loads) == 1
+    assert [event_data(subscriber.get_nowait()) for subscriber in subscribers] == \
+        [('snapshot', list(SNAPSHOT.values()))] * 3
+    snapshots.append(dict(SNAPSHOT, DRR=dict(SNAPSHOT['DRR'], place=2, lap_time='1:12:013')))
+    diff = broadcaster.publish()
+    assert len(loads) == 2
+    assert diff['finished'] == [snapshots[-1]['DRR']]
+    assert [event_data(subscriber.get_nowait()) for subscriber in subscribers] == [('diff', diff)] * 3
+    assert broadcaster.publish() is None
+    assert all(subscriber.empty() for subscriber in subscribers)
+
+
+def test_ReportBroadcaster_drops_slow_subscribers():
+    snapshots = [{}]
+    broadcaster = ReportBroadcaster(lambda: snapshots[-1], interval=3600, queue_size=2)
+    subscriber = broadcaster.subscribe()
+    for place in (1, 2):
+        snapshots.append({'SVF': dict(SNAPSHOT['SVF'], place=place)})
+        broadcaster.publish()
+    assert not broadcaster.is_subscribed(subscriber)
+    events = broadcaster.stream(subscriber)
+    assert event_data(next(events))[0] == 'snapshot'
+    assert event_data(next(events))[0] == 'diff'
+    assert list(events) == []
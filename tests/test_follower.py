@@ -0,0 +1,81 @@
+from follower import LogFollower, recompute_places
+from models import RacerTable, ReportTable, RacerSearchIndex, DataVersionTable, current_data_version
+from peewee import *
+from unittest.mock import Mock
+
+MODELS = [RacerTable, ReportTable, RacerSearchIndex, DataVersionTable]
+
+test_db = SqliteDatabase(':memory:')
+
+
+def setup_db():
+    test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+
+    test_db.connect()
+    test_db.create_tables(MODELS)
+
+
+def tear_down_db():
+    test_db.drop_tables(MODELS)
+    test_db.close()
+
+
+def places():
+    return dict(ReportTable.select(ReportTable.abbreviation, ReportTable.place).tuples())
+
+
+def write_logs(tmp_path):
+    (tmp_path / 'abbreviations.txt').write_text('SVF_Sebastian Vettel_FERRARI\n'
+                                                'VBM_Valtteri Bottas_MERCEDES\n'
+                                                'LHM_Lewis Hamilton_MERCEDES\n')
+    (tmp_path / 'start.log').write_text('SVF2018-05-24_12:02:58.917\n'
+                                        'VBM2018-05-24_12:00:00.000 \n'
+                                        'LHM2018-05-24_12:18:20.125\n')
+    (tmp_path / 'end.log').write_text('SVF2018-05-24_12:04:03.332\n'
+                                      'VBM2018-05-24_12:01:12.434')
+    return LogFollower(str(tmp_path / 'start.log'), str(tmp_path / 'end.log'), str(tmp_path / 'abbreviations.txt'),
+                       on_change=Mock())
+
+
+def test_LogFollower_initial_poll(tmp_path):
+    setup_db()
+    follower = write_logs(tmp_path)
+    assert follower.poll() == ['SVF', 'VBM']
+    assert places() == {'SVF': 1, 'VBM': 2}
+    matches = RacerSearchIndex.select().where(RacerSearchIndex.match('bottas'))
+    assert [racer.abbreviation for racer in matches] == ['VBM']
+    assert RacerTable.get(RacerTable.abbreviation == 'VBM').lap_time_str() == '1:12:434'
+    assert follower.poll() == []
+    follower.on_change.assert_called_once()
+    assert current_data_version() == 1
+    tear_down_db()
+
+
+def test_LogFollower_new_and_changed_finishers(tmp_path):
+    setup_db()
+    follower = write_logs(tmp_path)
+    follower.poll()
+    with open(tmp_path / 'end.log', 'a') as end_log:
+        end_log.write('\nLHM2018-05-24_12:19:')
+    assert follower.poll() == []
+    with open(tmp_path / 'end.log', 'a') as end_log:
+        end_log.write('20.000\n')
+    assert follower.poll() == ['LHM']
+    assert places() == {'LHM': 1, 'SVF': 2, 'VBM': 3}
+    with open(tmp_path / 'end.log', 'a') as end_log:
+        end_log.write('LHM2018-05-24_12:18:00.000\n')
+    assert follower.poll() == ['LHM']
+    assert places() == {'LHM': None, 'SVF': 1, 'VBM': 2}
+    tear_down_db()
+
+
+def test_recompute_places_updates_only_affected_racers():
+    setup_db()
+    for abbreviation, lap_time_ms, place in [('SVF', 64415, 1), ('VBM', 72434, 2), ('LHM', 70000, 3)]:
+        RacerTable.insert(abbreviation=abbreviation, name=abbreviation, team='TEAM',
+                          start_time='2018-05-24 12:00:00', finish_time='2018-05-24 12:01:00',
+                          lap_time_ms=lap_time_ms).execute()
+        ReportTable.create(abbreviation=abbreviation, place=place)
+    assert recompute_places(70000) == 2
+    assert places() == {'SVF': 1, 'LHM': 2, 'VBM': 3}
+    tear_down_db()
@@ -0,0 +1,59 @@
+import datetime
+import os
+import pytest
+from log_parser import iter_log_batches, read_race, race_rows, parse_log_line, MISSING_TIME
+
+FILES = os.path.join(os.path.dirname(__file__), '..', 'files')
+
+
+def test_iter_log_batches(tmp_path):
+    log = tmp_path / 'start.log'
+    log.write_text('SVF2018-05-24_12:02:58.917\nNHR2018-05-24_12:02:49.914 \n\nFAM2018-05-24_12:13:04.512')
+    batches = list(iter_log_batches(str(log), batch_size=2))
+    assert [abbreviations for abbreviations, timestamps in batches] == [['SVF', 'NHR'], ['FAM']]
+    (first, second), (third,) = [timestamps for abbreviations, timestamps in batches]
+    assert first - second == 9003
+    assert third - first == 605595
+
+
+def test_iter_log_batches_malformed_record(tmp_path):
+    log = tmp_path / 'end.log'
+    log.write_text('SVF2018-05-24_12:02:58\n')
+    with pytest.raises(ValueError):
+        list(iter_log_batches(str(log)))
+
+
+def test_iter_log_batches_empty_file(tmp_path):
+    log = tmp_path / 'end.log'
+    log.write_text('')
+    assert list(iter_log_batches(str(log))) == []
+
+
+def test_read_race_and_race_rows(tmp_path):
+    (tmp_path / 'abbreviations.txt').write_text('SVF_Sebastian Vettel_FERRARI\nDRR_Daniel Ricciardo_RED BULL RACING\n'
+                                                'LHM_Lewis Hamilton_MERCEDES\n')
+    (tmp_path / 'start.log').write_text('DRR2018-05-24_12:14:12.054\nSVF2018-05-24_12:02:58.917\n'
+                                        'LHM2018-05-24_12:18:20.125\n')
+    (tmp_path / 'end.log').write_text('SVF2018-05-24_12:04:03.332\nDRR2018-05-24_12:11:24.067\n')
+    race = read_race(str(tmp_path / 'start.log'), str(tmp_path / 'end.log'), str(tmp_path / 'abbreviations.txt'))
+    assert race.abbreviations == ['SVF', 'DRR', 'LHM']
+    assert race.finish_ms[2] == MISSING_TIME
+    assert list(race_rows(race)) == [
+        ('SVF', 'Sebastian Vettel', 'FERRARI', datetime.datetime(2018, 5, 24, 12, 2, 58, 917000),
+         datetime.datetime(2018, 5, 24, 12, 4, 3, 332000), datetime.timedelta(minutes=1, seconds=4, milliseconds=415),
+         64415),
+        ('DRR', 'Daniel Ricciardo', 'RED BULL RACING', datetime.datetime(2018, 5, 24, 12, 14, 12, 54000),
+         datetime.datetime(2018, 5, 24, 12, 11, 24, 67000), None, None)]
+
+
+def test_read_race_sample_files():
+    race = read_race(os.path.join(FILES, 'start.log'), os.path.join(FILES, 'end.log'),
+                     os.path.join(FILES, 'abbreviations.txt'))
+    rows = {row[0]: row for row in race_rows(race)}
+    assert len(rows) == 19
+    assert rows['SVF'][6] == 64415
+    with open(os.path.join(FILES, 'end.log')) as end_log:
+        for line in end_log:
+            if line.strip():
+                abbreviation, finish_time = parse_log_line(line)
+                assert rows[abbreviation][4] == finish_time
@@ -1,13 +1,21 @@
 import pytest
-from application_vlados import Racer
 import datetime
 from unittest.mock import patch
-from main import info_for_output, from_files_to_db, generate_output_data, app
-from models import ReportTable, RacerTable
+from main import info_for_output, from_files_to_db, generate_output_data, stream_output_data, app, report_cache, \
+    load_source_files, report_page, create_tables
+from models import index_racers, ReportTable, RacerTable, SourceFileTable, RaceTable, RaceResultTable, StandingTable, \
+    RacerSearchIndex, DataVersionTable, create_database, bump_data_version, init_database
+from races import race_to_db
+from log_parser import read_race
 from peewee import *
 from flask import Response
+import gzip
+import json
+import msgpack
+import zlib
 
-MODELS = [RacerTable, ReportTable]
+MODELS = [RacerTable, ReportTable, SourceFileTable, RaceTable, RaceResultTable, StandingTable, RacerSearchIndex,
+          DataVersionTable]
 
 test_db = SqliteDatabase(':memory:')
 
@@ -17,6 +25,7 @@ def setup_db():
 
     test_db.connect()
     test_db.create_tables(MODELS)
+    report_cache.invalidate()
 
 
 def tear_down_db():
@@ -24,19 +33,43 @@ def tear_down_db():
     test_db.close()
 
 
-@patch('main.processing_data')
-def test_from_files_to_db(mocked_processing_data):
+def write_race_files(directory, abbreviations, start_log, end_log):
+    paths = [directory / 'start.log', directory / 'end.log', directory / 'abbreviations.txt']
+    for path, content in zip(paths, (start_log, end_log, abbreviations)):
+        path.write_text(content)
+    return paths
+
+
+def test_from_files_to_db(tmp_path):
     setup_db()
-    mocked_processing_data.return_value = {'Sebastian Vettel':
-                                               Racer('Sebastian Vettel', 'SVF', 'FERRARI',
-                                                     datetime.datetime(2018, 5, 24, 12, 2, 58, 917),
-                                                     datetime.datetime(2018, 5, 24, 12, 4, 3, 332)),
-                                           'Daniel Ricciardo':
-                                               Racer('Daniel Ricciardo', 'DRR', 'RED BULL RACING TAG HEUER',
-                                                     datetime.datetime(2018, 5, 24, 12, 14, 12, 54),
-                                                     datetime.datetime(2018, 5, 24, 12, 11, 24, 67))}
-    from_files_to_db('fake/file/path', 'fake/file/path', 'fake/file/path')
-    assert RacerTable.get(RacerTable.abbreviation == 'SVF').name == 'Sebastian Vettel'
+    paths = write_race_files(tmp_path,
+                             'SVF_Sebastian Vettel_FERRARI\nDRR_Daniel Ricciardo_RED BULL RACING TAG HEUER\n',
+                             'SVF2018-05-24_12:02:58.917\nDRR2018-05-24_12:14:12.054 \n\n',
+                             'SVF2018-05-24_12:04:03.332\nDRR2018-05-24_12:11:24.067')
+    assert from_files_to_db(*paths) == 2
+    racer = RacerTable.get(RacerTable.abbreviation == 'SVF')
+    assert racer.name == 'Sebastian Vettel'
+    assert racer.start_time == datetime.datetime(2018, 5, 24, 12, 2, 58, 917000)
+    assert racer.lap_time == datetime.time(0, 1, 4, 415000)
+    assert racer.lap_time_ms == 64415
+    assert RacerTable.get(RacerTable.abbreviation == 'DRR').lap_time is None
+    assert ReportTable.get(ReportTable.abbreviation == 'SVF').place == 1
+    assert ReportTable.get(ReportTable.abbreviation == 'DRR').place is None
+    tear_down_db()
+
+
+def test_from_files_to_db_is_atomic(tmp_path):
+    setup_db()
+    paths = write_race_files(tmp_path,
+                             'SVF_Sebastian Vettel_FERRARI\nDRR_Daniel Ricciardo_RED BULL RACING TAG HEUER\n',
+                             'SVF2018-05-24_12:02:58.917\nDRR2018-05-24_12:14:12.054\n',
+                             'SVF2018-05-24_12:04:03.332\nDRR2018-05-24_12:11:24.067\n')
+    RacerTable.create(abbreviation='DRR', name='Daniel Ricciardo', team='RED BULL RACING TAG HEUER',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 14, 12, 54),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 11, 24, 67))
+    assert from_files_to_db(*paths, batch_size=1) == 0
+    assert RacerTable.select().count() == 1
+    assert ReportTable.select().count() == 0
     tear_down_db()
 
 
@@ -123,6 +156,35 @@ def test_info_for_output(ordering, expected_result):
     tear_down_db()
 
 
+@pytest.mark.parametrize("ordering", ['desc', 'asc'])
+def test_info_for_output_single_query_with_dnf_last(ordering):
+    setup_db()
+    RacerTable.create(abbreviation='SVF', name='Sebastian Vettel', team='FERRARI',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 2, 58, 917),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 2, 3, 332),
+                      lap_time=datetime.time(0, 1, 4, 415000))
+    RacerTable.create(abbreviation='DRR', name='Daniel Ricciardo', team='RED BULL RACING TAG HEUER',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 14, 12, 54),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 11, 24, 67))
+    RacerTable.create(abbreviation='VBM', name='Valtteri Bottas', team='MERCEDES',
+                      start_time=datetime.datetime(2018, 5, 24, 12),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 1, 12, 434),
+                      lap_time=datetime.time(0, 1, 12, 434000))
+    ReportTable.create(abbreviation='DRR', place=None)
+    ReportTable.create(abbreviation='SVF', place=1)
+    ReportTable.create(abbreviation='VBM', place=2)
+    with patch.object(test_db, 'execute_sql', wraps=test_db.execute_sql) as execute_sql:
+        info = info_for_output(ordering)
+    assert execute_sql.call_count == 1
+    names = [next(iter(racer)) for racer in info]
+    assert names[-1] == 'Daniel Ricciardo'
+    assert info[-1]['Daniel Ricciardo'] == {'place': None, 'name': 'Daniel Ricciardo',
+                                            'team': 'RED BULL RACING TAG HEUER', 'lap_time': '-'}
+    assert names[:2] == (['Valtteri Bottas', 'Sebastian Vettel'] if ordering == 'desc'
+                         else ['Sebastian Vettel', 'Valtteri Bottas'])
+    tear_down_db()
+
+
 @pytest.mark.parametrize("path, expected_output", [('/api/v1/report/', b'[{"Sebastian Vettel":{"lap_time":"1:04:415",'
                                                                        b'"name":"Sebastian Vettel","place":1,'
                                                                        b'"team":"FERRARI"}},'
@@ -211,3 +273,463 @@ def test_drivers(client, path, expected_output):
     assert response.status_code == 200
     assert response.data == expected_output
     tear_down_db()
+
+
+def test_report_etag(client):
+    setup_db()
+    RacerTable.create(abbreviation='SVF', name='Sebastian Vettel', team='FERRARI',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 2, 58, 917),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 2, 3, 332),
+                      lap_time=datetime.time(0, 1, 4, 415000))
+    ReportTable.create(abbreviation='SVF', place=1)
+    response = client.get('/api/v1/report/')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    cached_response = client.get('/api/v1/report/', headers={'If-None-Match': etag})
+    assert cached_response.status_code == 304
+    assert cached_response.data == b''
+    report_cache.invalidate()
+    ReportTable.update(place=2).execute()
+    fresh_response = client.get('/api/v1/report/', headers={'If-None-Match': etag})
+    assert fresh_response.status_code == 200
+    assert b'"place":2' in fresh_response.data
+    tear_down_db()
+
+
+def create_racers_with_dnf():
+    RacerTable.create(abbreviation='SVF', name='Sebastian Vettel', team='FERRARI',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 2, 58, 917),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 2, 3, 332),
+                      lap_time=datetime.time(0, 1, 4, 415000))
+    RacerTable.create(abbreviation='VBM', name='Valtteri Bottas', team='MERCEDES',
+                      start_time=datetime.datetime(2018, 5, 24, 12),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 1, 12, 434),
+                      lap_time=datetime.time(0, 1, 12, 434000))
+    RacerTable.create(abbreviation='DRR', name='Daniel Ricciardo', team='RED BULL RACING TAG HEUER',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 14, 12, 54),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 11, 24, 67))
+    RacerTable.create(abbreviation='LHM', name='Lewis Hamilton', team='MERCEDES',
+                      start_time=datetime.datetime(2018, 5, 24, 12, 18, 20, 125),
+                      finish_time=datetime.datetime(2018, 5, 24, 12, 11, 32, 585))
+    ReportTable.create(abbreviation='SVF', place=1)
+    ReportTable.create(abbreviation='VBM', place=2)
+    ReportTable.create(abbreviation='DRR', place=None)
+    ReportTable.create(abbreviation='LHM', place=None)
+
+
+@pytest.mark.parametrize("order, expected_names", [('asc', ['Sebastian Vettel', 'Valtteri Bottas',
+                                                            'Daniel Ricciardo', 'Lewis Hamilton']),
+                                                   ('desc', ['Valtteri Bottas', 'Sebastian Vettel',
+                                                             'Daniel Ricciardo', 'Lewis Hamilton'])])
+def test_report_pagination(client, order, expected_names):
+    setup_db()
+    create_racers_with_dnf()
+    names = []
+    pages = 0
+    path = f'/api/v1/report/?order={order}&limit=1'
+    while path:
+        response = client.get(path)
+        assert response.status_code == 200
+        names.extend(next(iter(racer)) for racer in response.get_json())
+        pages += 1
+        path = response.headers.get('Link', '').partition('<')[2].partition('>')[0]
+        if path:
+            assert response.headers['X-Next-Cursor'] in path
+    assert names == expected_names
+    assert pages == 4
+    tear_down_db()
+
+
+@pytest.mark.parametrize("query, expected_names", [('team=MERCEDES', ['Valtteri Bottas', 'Lewis Hamilton']),
+                                                   ('status=finished', ['Sebastian Vettel', 'Valtteri Bottas']),
+                                                   ('status=dnf', ['Daniel Ricciardo', 'Lewis Hamilton']),
+                                                   ('place_from=2', ['Valtteri Bottas']),
+                                                   ('place_to=1', ['Sebastian Vettel']),
+                                                   ('team=MERCEDES&limit=1&order=desc', ['Valtteri Bottas'])])
+def test_report_filters(client, query, expected_names):
+    setup_db()
+    create_racers_with_dnf()
+    response = client.get(f'/api/v1/report/?{query}')
+    assert response.status_code == 200
+    assert [next(iter(racer)) for racer in response.get_json()] == expected_names
+    tear_down_db()
+
+
+@pytest.mark.parametrize("query", ['limit=0', 'limit=abc', 'limit=%C2%B2', 'limit=5000',
+                                   'limit=1&cursor=broken', 'status=done', 'place_from=-1'])
+def test_report_invalid_parameters(client, query):
+    setup_db()
+    response = client.get(f'/api/v1/report/?{query}')
+    assert response.status_code == 400
+    tear_down_db()
+
+
+@pytest.mark.parametrize("format_for_output", ['json', 'xml'])
+@pytest.mark.parametrize("number_of_racers", [0, 1, 3])
+@pytest.mark.parametrize("debug", [False, True])
+def test_stream_output_data_matches_generate_output_data(format_for_output, number_of_racers, debug):
+    info_for_api = [{f'Racer {number}': {'lap_time': '1:04:415',
+                                         'name': f'Racer {number}',
+                                         'place': number,
+                                         'team': 'FERRARI'}} for number in range(1, number_of_racers + 1)]
+    app.debug = debug
+    try:
+        with app.test_request_context():
+            expected_output = generate_output_data(info_for_api, format_for_output)
+            actual_output = stream_output_data(iter(info_for_api), format_for_output, chunk_size=2)
+            assert actual_output.is_streamed
+            assert actual_output.mimetype == expected_output.mimetype
+            assert actual_output.get_data() == expected_output.get_data()
+    finally:
+        app.debug = False
+
+
+@pytest.mark.parametrize("path", ['/api/v1/report/?order=desc', '/api/v1/report/?format=xml',
+                                  '/api/v1/report/?status=dnf', '/api/v1/report/drivers/'])
+def test_report_stream(client, path):
+    setup_db()
+    create_racers_with_dnf()
+    expected_output = client.get(path).data
+    response = client.get(path + ('&' if '?' in path else '?') + 'stream=1')
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.data == expected_output
+    tear_down_db()
+
+
+@pytest.mark.parametrize("path, headers, expected_mimetype, expected_output",
+                         [('/api/v1/report/?format=ndjson', {}, 'application/x-ndjson',
+                           b'{"Sebastian Vettel":{"lap_time":"1:04:415","name":"Sebastian Vettel","place":1,'
+                           b'"team":"FERRARI"}}\n{"Valtteri Bottas":{"lap_time":"1:12:434","name":"Valtteri Bottas",'
+                           b'"place":2,"team":"MERCEDES"}}\n'),
+                          ('/api/v1/report/', {'Accept': 'text/csv'}, 'text/csv',
+                           b'place,name,team,lap_time\r\n1,Sebastian Vettel,FERRARI,1:04:415\r\n'
+                           b'2,Valtteri Bottas,MERCEDES,1:12:434\r\n'),
+                          ('/api/v1/report/drivers/?abbreviation=SVF&format=csv', {}, 'text/csv',
+                           b'name,team,lap_time\r\nSebastian Vettel,FERRARI,1:04:415\r\n'),
+                          ('/api/v1/report/?order=desc', {'Accept': 'application/xml,*/*;q=0.8'}, 'application/xml',
+                           b'<racers>\n  <Valtteri_Bottas>\n    <lap_time>1:12:434</lap_time>\n    '
+                           b'<name>Valtteri Bottas</name>\n    <place>2</place>\n    <team>MERCEDES</team>\n  '
+                           b'</Valtteri_Bottas>\n</racers>\n<racers>\n  <Sebastian_Vettel>\n    '
+                           b'<lap_time>1:04:415</lap_time>\n    <name>Sebastian Vettel</name>\n    '
+                           b'<place>1</place>\n    <team>FERRARI</team>\n  </Sebastian_Vettel>\n</racers>'),
+                          ('/api/v1/report/?format=json', {'Accept': 'text/csv'}, 'application/json',
+                           b'[{"Sebastian Vettel":{"lap_time":"1:04:415","name":"Sebastian Vettel","place":1,'
+                           b'"team":"FERRARI"}},{"Valtteri Bottas":{"lap_time":"1:12:434","name":"Valtteri Bottas",'
+                           b'"place":2,"team":"MERCEDES"}}]\n'),
+                          ('/api/v1/report/',
+                           {'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'},
+                           'application/json',
+                           b'[{"Sebastian Vettel":{"lap_time":"1:04:415","name":"Sebastian Vettel","place":1,'
+                           b'"team":"FERRARI"}},{"Valtteri Bottas":{"lap_time":"1:12:434","name":"Valtteri Bottas",'
+                           b'"place":2,"team":"MERCEDES"}}]\n')])
+def test_report_formats(client, path, headers, expected_mimetype, expected_output):
+    setup_db()
+    create_racers_with_dnf()
+    ReportTable.delete().where(ReportTable.place.is_null()).execute()
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == expected_mimetype
+    assert response.data == expected_output
+    assert client.get(path + ('&' if '?' in path else '?') + 'stream=1', headers=headers).data == expected_output
+    tear_down_db()
+
+
+def test_report_msgpack(client):
+    setup_db()
+    create_racers_with_dnf()
+    response = client.get('/api/v1/report/', headers={'Accept': 'application/x-msgpack'})
+    assert response.mimetype == 'application/x-msgpack'
+    assert msgpack.unpackb(response.data) == client.get('/api/v1/report/').get_json()
+    tear_down_db()
+
+
+@pytest.mark.parametrize("encoding, decompress", [('gzip', gzip.decompress), ('deflate', zlib.decompress)])
+def test_report_compression(client, encoding, decompress):
+    setup_db()
+    create_racers_with_dnf()
+    expected_output = client.get('/api/v1/report/?format=xml').data
+    assert 'Content-Encoding' not in client.get('/api/v1/report/?format=xml').headers
+    response = client.get('/api/v1/report/?format=xml', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert decompress(response.data) == expected_output
+    cached_response = client.get('/api/v1/report/?format=xml', headers={'Accept-Encoding': encoding,
+                                                                        'If-None-Match': response.headers['ETag']})
+    assert cached_response.status_code == 304
+    tear_down_db()
+
+
+def test_request_connection_is_closed_on_teardown(client, tmp_path):
+    file_db = SqliteDatabase(str(tmp_path / 'database.db'))
+    file_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    file_db.create_tables(MODELS)
+    file_db.close()
+    report_cache.invalidate()
+    response = client.get('/api/v1/report/?stream=1')
+    assert response.status_code == 200
+    assert response.data == b'[]\n'
+    assert file_db.is_closed()
+    file_db.connect()
+    response = client.get('/api/v1/report/')
+    assert not file_db.is_closed()
+    file_db.close()
+
+
+def test_load_source_files(tmp_path):
+    setup_db()
+    paths = write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\n', 'SVF2018-05-24_12:02:58.917\n',
+                             'SVF2018-05-24_12:04:03.332\n')
+    with patch('main.read_race', wraps=read_race) as mocked_read_race:
+        assert load_source_files(*paths)
+        assert mocked_read_race.call_count == 1
+        assert SourceFileTable.select().count() == 3
+        assert not load_source_files(*paths)
+        paths[0].touch()
+        assert not load_source_files(*paths)
+        assert mocked_read_race.call_count == 1
+        write_race_files(tmp_path, 'VBM_Valtteri Bottas_MERCEDES\n', 'VBM2018-05-24_12:00:00.000\n',
+                         'VBM2018-05-24_12:01:12.434\n')
+        assert load_source_files(*paths)
+        assert mocked_read_race.call_count == 2
+    assert [racer.abbreviation for racer in RacerTable.select()] == ['VBM']
+    assert ReportTable.get().place == 1
+    tear_down_db()
+
+
+def test_load_source_files_notifies_after_commit(tmp_path):
+    setup_db()
+    paths = write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\n', 'SVF2018-05-24_12:02:58.917\n',
+                             'SVF2018-05-24_12:04:03.332\n')
+    in_transaction = []
+    with patch('main.data_changed', side_effect=lambda: in_transaction.append(test_db.in_transaction())) as changed:
+        assert load_source_files(*paths)
+        assert not load_source_files(*paths)
+    assert changed.call_count == 1
+    assert in_transaction == [False]
+    tear_down_db()
+
+
+def test_apidocs_are_built_lazily(client):
+    app.wsgi_app.docs_app = None
+    assert client.get('/').status_code == 404
+    assert app.wsgi_app.docs_app is None
+    response = client.get('/apispec_1.json')
+    assert response.status_code == 200
+    assert '/api/v1/report/' in response.get_json()['paths']
+    assert client.get('/apidocs/').status_code == 200
+
+
+def test_standings_and_race_report(client, tmp_path):
+    setup_db()
+    monaco = write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\nVBM_Valtteri Bottas_MERCEDES\n',
+                              'SVF2018-05-24_12:00:00.000\nVBM2018-05-24_12:00:00.000\n',
+                              'SVF2018-05-24_12:01:04.415\nVBM2018-05-24_12:01:12.434\n')
+    race_to_db('Monaco 2018', *monaco)
+    response = client.get('/api/v1/standings/')
+    assert response.status_code == 200
+    assert response.get_json() == [{'Sebastian Vettel': {'position': 1, 'name': 'Sebastian Vettel', 'team': 'FERRARI',
+                                                         'points': 25, 'races': 1, 'wins': 1}},
+                                   {'Valtteri Bottas': {'position': 2, 'name': 'Valtteri Bottas', 'team': 'MERCEDES',
+                                                        'points': 18, 'races': 1, 'wins': 0}}]
+    assert client.get('/api/v1/standings/?season=2017').get_json() == []
+    response = client.get('/api/v1/report/?race=Monaco%202018&order=desc&limit=1')
+    assert response.get_json() == [{'Valtteri Bottas': {'place': 2, 'name': 'Valtteri Bottas', 'team': 'MERCEDES',
+                                                        'lap_time': '1:12:434'}}]
+    response = client.get(response.headers['Link'].partition('<')[2].partition('>')[0])
+    assert [next(iter(racer)) for racer in response.get_json()] == ['Sebastian Vettel']
+    assert client.get('/api/v1/report/?race=Unknown').status_code == 404
+    assert client.get('/api/v1/report/').get_json() == []
+    tear_down_db()
+
+
+def test_drivers_search_keeps_rank_and_namesakes(client):
+    setup_db()
+    create_racers_with_dnf()
+    for abbreviation, name, team in (('SVX', 'Sebastian Vettel', 'WILLIAMS'), ('ZVV', 'Vettel', 'VETTEL')):
+        RacerTable.create(abbreviation=abbreviation, name=name, team=team, start_time=datetime.datetime(2018, 5, 24),
+                          finish_time=datetime.datetime(2018, 5, 24))
+    index_racers()
+    racers = client.get('/api/v1/report/drivers/?search=vettel%20ferrari').get_json()
+    assert racers == [{'Sebastian Vettel': {'place': 1, 'name': 'Sebastian Vettel', 'team': 'FERRARI',
+                                            'lap_time': '1:04:415'}}]
+    racers = client.get('/api/v1/report/drivers/?search=vettel').get_json()
+    assert [(name, info['team']) for racer in racers for name, info in racer.items()] == [
+        ('Vettel', 'VETTEL'), ('Sebastian Vettel', 'FERRARI'), ('Sebastian Vettel', 'WILLIAMS')]
+    tear_down_db()
+
+
+def test_drivers_of_a_stored_race(client, tmp_path):
+    setup_db()
+    create_racers_with_dnf()
+    index_racers()
+    race_to_db('Monaco', *write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\n', 'SVF2018-05-24_12:00:00.000\n',
+                                           'SVF2018-05-24_12:01:30.000\n'))
+    assert client.get('/api/v1/report/drivers/?race=Monaco&abbreviation=SVF').get_json() == {
+        'Sebastian Vettel': {'name': 'Sebastian Vettel', 'team': 'FERRARI', 'lap_time': '1:30:000'}}
+    assert client.get('/api/v1/report/drivers/?race=Monaco&abbreviation=VBM').status_code == 404
+    assert client.get('/api/v1/report/drivers/?race=Nope&abbreviation=SVF').status_code == 404
+    assert client.get('/api/v1/report/drivers/?race=Monaco&search=vettel').status_code == 400
+    tear_down_db()
+
+
+@pytest.mark.parametrize("ordering", ['asc', 'desc'])
+@pytest.mark.parametrize("in_race", [False, True])
+def test_report_page_seeks_the_place_index(tmp_path, ordering, in_race):
+    setup_db()
+    create_racers_with_dnf()
+    race = None
+    if in_race:
+        race_to_db('Monaco 2018', *write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\n',
+                                                    'SVF2018-05-24_12:00:00.000\n', 'SVF2018-05-24_12:01:04.415\n'))
+        race = RaceTable.get().id
+    with patch.object(test_db, 'execute_sql', wraps=test_db.execute_sql) as execute_sql:
+        report_page(ordering, 10, (1, 'SVF'), race=race)
+    assert execute_sql.call_count == 2
+    for call in execute_sql.call_args_list:
+        sql, params = call.args[:2]
+        plan = [row[-1] for row in test_db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)]
+        assert any(step.startswith('SEARCH') and ('place' in step or 'race' in step) for step in plan), plan
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+    tear_down_db()
+
+
+@pytest.mark.parametrize("query, expected_names", [('abbreviation=VBM,SVF', ['Valtteri Bottas', 'Sebastian Vettel']),
+                                                   ('abbreviation=SVF,XXX,SVF', ['Sebastian Vettel']),
+                                                   ('search=ham', ['Lewis Hamilton']),
+                                                   ('search=mercedes', ['Lewis Hamilton', 'Valtteri Bottas']),
+                                                   ('search=Seb%20ferr', ['Sebastian Vettel']),
+                                                   ('search="red', ['Daniel Ricciardo']),
+                                                   ('search=ferrari%20mercedes', [])])
+def test_drivers_batch_and_search(client, query, expected_names):
+    setup_db()
+    create_racers_with_dnf()
+    index_racers()
+    with patch.object(test_db, 'execute_sql', wraps=test_db.execute_sql) as execute_sql:
+        response = client.get(f'/api/v1/report/drivers/?{query}')
+    assert len([call for call in execute_sql.call_args_list if 'DataVersion' not in call.args[0]]) == 1
+    assert response.status_code == 200
+    if query.startswith('search='):
+        assert [next(iter(racer)) for racer in response.get_json()] == expected_names
+    else:
+        assert sorted(response.get_json()) == sorted(expected_names)
+    tear_down_db()
+
+
+@pytest.mark.parametrize("query, expected_status", [('abbreviation=XXX', 404), ('abbreviation=XXX,YYY', 404),
+                                                    ('search=%22%20*', 400)])
+def test_drivers_errors(client, query, expected_status):
+    setup_db()
+    create_racers_with_dnf()
+    index_racers()
+    assert client.get(f'/api/v1/report/drivers/?{query}').status_code == expected_status
+    tear_down_db()
+
+
+def test_from_files_to_db_builds_search_index(client, tmp_path):
+    setup_db()
+    paths = write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\n', 'SVF2018-05-24_12:02:58.917\n',
+                             'SVF2018-05-24_12:04:03.332\n')
+    from_files_to_db(*paths)
+    assert client.get('/api/v1/report/drivers/?search=vettel').get_json() == [
+        {'Sebastian Vettel': {'place': 1, 'name': 'Sebastian Vettel', 'team': 'FERRARI', 'lap_time': '1:04:415'}}]
+    tear_down_db()
+
+
+def metric_value(metrics, sample):
+    return next((float(line.rsplit(' ', 1)[1]) for line in metrics.splitlines() if line.startswith(sample + ' ')), 0)
+
+
+def test_metrics_endpoint(client):
+    timed_db = create_database(':memory:', pragmas={})
+    timed_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    timed_db.connect()
+    timed_db.create_tables(MODELS)
+    report_cache.invalidate()
+    samples = ['report_requests_total{endpoint="report",status="200"}',
+               'report_requests_total{endpoint="drivers",status="404"}',
+               'report_request_db_queries_bucket{endpoint="report",le="1"}',
+               'report_request_db_queries_bucket{endpoint="report",le="2"}',
+               'report_response_size_bytes_count{endpoint="report"}']
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/api/v1/report/')
+    client.get('/api/v1/report/')
+    client.get('/api/v1/report/drivers/?abbreviation=XXX')
+    after = client.get('/metrics').get_data(as_text=True)
+    assert [metric_value(after, sample) - metric_value(before, sample) for sample in samples] == [2, 1, 1, 2, 2]
+    assert 'report_phase_seconds_total{endpoint="report",phase="serialize"}' in after
+    timed_db.drop_tables(MODELS)
+    timed_db.close()
+
+
+def test_server_timing_header(client):
+    setup_db()
+    assert 'Server-Timing' not in client.get('/api/v1/report/').headers
+    app.config['SERVER_TIMING'] = True
+    try:
+        report_cache.invalidate()
+        server_timing = client.get('/api/v1/report/').headers['Server-Timing']
+    finally:
+        app.config['SERVER_TIMING'] = False
+    assert server_timing.startswith('db;dur=')
+    assert 'build;dur=' in server_timing and 'serialize;dur=' in server_timing and 'total;dur=' in server_timing
+    tear_down_db()
+
+
+def test_report_events(client, tmp_path):
+    file_db = SqliteDatabase(str(tmp_path / 'database.db'))
+    file_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    file_db.create_tables(MODELS)
+    report_cache.invalidate()
+    response = client.get('/api/v1/report/events/')
+    assert response.mimetype == 'text/event-stream'
+    events = response.iter_encoded()
+    assert next(events) == b'id: 0\nevent: snapshot\ndata: []\n\n'
+    paths = write_race_files(tmp_path, 'SVF_Sebastian Vettel_FERRARI\n', 'SVF2018-05-24_12:02:58.917\n',
+                             'SVF2018-05-24_12:04:03.332\n')
+    from_files_to_db(*paths)
+    event = next(events).decode()
+    assert event.startswith('id: 1\nevent: diff\n')
+    assert json.loads(event.split('data: ', 1)[1])['finished'] == [
+        {'abbreviation': 'SVF', 'place': 1, 'name': 'Sebastian Vettel', 'team': 'FERRARI', 'lap_time': '1:04:415'}]
+    response.close()
+    file_db.close()
+
+
+def test_cache_follows_writes_of_other_processes(client, tmp_path):
+    file_db = SqliteDatabase(str(tmp_path / 'database.db'))
+    file_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    file_db.create_tables(MODELS)
+    create_racers_with_dnf()
+    file_db.close()
+    report_cache.invalidate()
+    assert len(client.get('/api/v1/report/?status=finished&limit=1').get_json()) == 1
+    other_process_db = SqliteDatabase(str(tmp_path / 'database.db'))
+    with other_process_db.bind_ctx(MODELS, bind_refs=False, bind_backrefs=False):
+        with other_process_db.atomic():
+            ReportTable.update(place=None).execute()
+            bump_data_version()
+    other_process_db.close()
+    assert client.get('/api/v1/report/?status=finished&limit=1').get_json() == []
+
+
+def test_create_tables_upgrades_baseline_database(tmp_path):
+    file_db = init_database(str(tmp_path / 'database.db'))
+    file_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    file_db.execute_sql('CREATE TABLE "Racers" ("abbreviation" VARCHAR(255) NOT NULL PRIMARY KEY, '
+                        '"name" VARCHAR(255) NOT NULL, "team" VARCHAR(255) NOT NULL, '
+                        '"start_time" DATETIME NOT NULL, "finish_time" DATETIME NOT NULL, "lap_time" TIME)')
+    file_db.execute_sql('CREATE TABLE "Report" ("abbreviation_id" VARCHAR(255) NOT NULL PRIMARY KEY, '
+                        '"place" INTEGER, FOREIGN KEY ("abbreviation_id") REFERENCES "Racers" ("abbreviation"))')
+    file_db.execute_sql("INSERT INTO \"Racers\" VALUES ('SVF', 'Sebastian Vettel', 'FERRARI', "
+                        "'2018-05-24 12:02:58.917', '2018-05-24 12:04:03.332', '00:01:04.415000')")
+    file_db.execute_sql("INSERT INTO \"Report\" VALUES ('SVF', 1)")
+    file_db.close()
+    try:
+        create_tables()
+        with file_db.connection_context():
+            assert file_db.execute_sql('PRAGMA integrity_check').fetchone() == ('ok',)
+            assert RacerTable.get(RacerTable.abbreviation == 'SVF').lap_time_ms == 64415
+            assert [racer.abbreviation for racer in RacerSearchIndex.select()] == ['SVF']
+    finally:
+        init_database()
@@ -0,0 +1,27 @@
+from metrics import MetricsRegistry
+
+
+def test_MetricsRegistry_counter():
+    registry = MetricsRegistry()
+    registry.counter('requests_total', 'Requests served.')
+    registry.inc('requests_total', {'endpoint': 'report', 'status': 200})
+    registry.inc('requests_total', {'status': 200, 'endpoint': 'report'}, 2)
+    registry.inc('requests_total', {'endpoint': 'say "hi"'})
+    assert registry.render() == ('# HELP requests_total Requests served.\n'
+                                 '# TYPE requests_total counter\n'
+                                 'requests_total{endpoint="report",status="200"} 3\n'
+                                 'requests_total{endpoint="say \\"hi\\""} 1\n')
+
+
+def test_MetricsRegistry_histogram():
+    registry = MetricsRegistry()
+    registry.histogram('latency_seconds', 'Request latency.', (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        registry.observe('latency_seconds', {'endpoint': 'report'}, value)
+    assert registry.render() == ('# HELP latency_seconds Request latency.\n'
+                                 '# TYPE latency_seconds histogram\n'
+                                 'latency_seconds_bucket{endpoint="report",le="0.1"} 2\n'
+                                 'latency_seconds_bucket{endpoint="report",le="1.0"} 3\n'
+                                 'latency_seconds_bucket{endpoint="report",le="+Inf"} 4\n'
+                                 'latency_seconds_sum{endpoint="report"} 3.65\n'
+                                 'latency_seconds_count{endpoint="report"} 4\n')
@@ -1,8 +1,11 @@
 import datetime
-from models import RacerTable, ReportTable
+from models import RacerTable, ReportTable, RacerSearchIndex, format_lap_time, lap_time_to_ms, migrate_schema, \
+    create_database, configured_pragmas, DEFAULT_PRAGMAS
+from playhouse.pool import PooledSqliteDatabase
+import pytest
 from peewee import *
 
-MODELS = [RacerTable, ReportTable]
+MODELS = [RacerTable, ReportTable, RacerSearchIndex]
 
 test_db = SqliteDatabase(':memory:')
 
@@ -31,6 +34,7 @@ def test_RacerTable():
     assert racer.start_time == datetime.datetime(2018, 5, 24, 12, 2, 58, 917)
     assert racer.finish_time == datetime.datetime(2018, 5, 24, 12, 2, 3, 332)
     assert racer.lap_time == datetime.time(minute=1, second=4, microsecond=415000)
+    assert racer.lap_time_ms == 64415
     assert racer.lap_time_str() == '1:04:415'
     tear_down_db()
 
@@ -45,3 +49,61 @@ def test_ReportTable():
     assert isinstance(racers_report_data.abbreviation, RacerTable)
     assert racers_report_data.place == 1
     tear_down_db()
+
+
+@pytest.mark.parametrize("lap_time, expected_ms", [(datetime.time(0, 1, 4, 415000), 64415),
+                                                   (datetime.time(0, 1, 12, 434999), 72434),
+                                                   (datetime.timedelta(minutes=1, seconds=4, milliseconds=415), 64415),
+                                                   (None, None)])
+def test_lap_time_to_ms(lap_time, expected_ms):
+    assert lap_time_to_ms(lap_time) == expected_ms
+
+
+@pytest.mark.parametrize("lap_time_ms, expected_output", [(64415, '1:04:415'), (5007, '0:05:007'), (None, '-')])
+def test_format_lap_time(lap_time_ms, expected_output):
+    assert format_lap_time(lap_time_ms) == expected_output
+
+
+def test_migrate_schema():
+    test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    test_db.connect()
+    test_db.execute_sql('CREATE TABLE "Racers" ("abbreviation" VARCHAR(255) NOT NULL PRIMARY KEY, '
+                        '"name" VARCHAR(255) NOT NULL, "team" VARCHAR(255) NOT NULL, '
+                        '"start_time" DATETIME NOT NULL, "finish_time" DATETIME NOT NULL, "lap_time" TIME)')
+    test_db.execute_sql('CREATE TABLE "Report" ("abbreviation_id" VARCHAR(255) NOT NULL PRIMARY KEY, '
+                        '"place" INTEGER)')
+    test_db.execute_sql("INSERT INTO \"Racers\" VALUES ('SVF', 'Sebastian Vettel', 'FERRARI', "
+                        "'2018-05-24 12:02:58.917', '2018-05-24 12:04:03.332', '00:01:04.415000')")
+    migrate_schema()
+    migrate_schema()
+    assert RacerTable.get(RacerTable.abbreviation == 'SVF').lap_time_ms == 64415
+    indexes = [index.columns for model in MODELS for index in test_db.get_indexes(model._meta.table_name)]
+    assert indexes.count(['lap_time_ms']) == 1
+    assert ['team'] in indexes
+    assert ['place', 'abbreviation_id'] in indexes
+    tear_down_db()
+
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_create_database(tmp_path, pooled):
+    options = {'max_connections': 2} if pooled else {}
+    database = create_database(str(tmp_path / 'database.db'), pooled=pooled, **options)
+    assert isinstance(database, PooledSqliteDatabase) == pooled
+    with database.connection_context():
+        assert database.execute_sql('PRAGMA journal_mode').fetchone() == ('wal',)
+        assert database.execute_sql('PRAGMA synchronous').fetchone() == (1,)
+    database = create_database(str(tmp_path / 'database.db'), pragmas={'cache_size': -1000})
+    with database.connection_context():
+        assert database.execute_sql('PRAGMA cache_size').fetchone() == (-1000,)
+
+
+def test_configured_pragmas(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_PRAGMAS', raising=False)
+    assert configured_pragmas() == DEFAULT_PRAGMAS
+    monkeypatch.setenv('DATABASE_PRAGMAS', '{"cache_size": -1000, "mmap_size": null, "busy_timeout": 5000}')
+    assert configured_pragmas() == {'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -1000,
+                                    'busy_timeout': 5000}
+    database = create_database(str(tmp_path / 'database.db'))
+    with database.connection_context():
+        assert database.execute_sql('PRAGMA cache_size').fetchone() == (-1000,)
+        assert database.execute_sql('PRAGMA busy_timeout').fetchone() == (5000,)
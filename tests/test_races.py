@@ -0,0 +1,92 @@
+from log_parser import read_race
+from models import RaceTable, RaceResultTable, StandingTable, DataVersionTable, current_data_version
+from main import app
+from races import store_race, race_to_db, standings_query, latest_season, race_points, ingest_race_directories
+from peewee import *
+import pytest
+
+MODELS = [RaceTable, RaceResultTable, StandingTable, DataVersionTable]
+
+test_db = SqliteDatabase(':memory:')
+
+
+def setup_db():
+    test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+
+    test_db.connect()
+    test_db.create_tables(MODELS)
+
+
+def tear_down_db():
+    test_db.drop_tables(MODELS)
+    test_db.close()
+
+
+def write_race(directory, start_log, end_log):
+    directory.mkdir()
+    (directory / 'abbreviations.txt').write_text('SVF_Sebastian Vettel_FERRARI\nVBM_Valtteri Bottas_MERCEDES\n'
+                                                 'LHM_Lewis Hamilton_MERCEDES\n')
+    (directory / 'start.log').write_text(start_log)
+    (directory / 'end.log').write_text(end_log)
+    return [str(directory / name) for name in ('start.log', 'end.log', 'abbreviations.txt')]
+
+
+@pytest.mark.parametrize("place, expected_points", [(1, 25), (2, 18), (10, 1), (11, 0), (None, 0)])
+def test_race_points(place, expected_points):
+    assert race_points(place) == expected_points
+
+
+def test_store_race_and_standings(tmp_path):
+    setup_db()
+    monaco = write_race(tmp_path / 'monaco',
+                        'SVF2018-05-24_12:00:00.000\nVBM2018-05-24_12:00:00.000\nLHM2018-05-24_12:00:00.000\n',
+                        'SVF2018-05-24_12:01:04.415\nVBM2018-05-24_12:01:12.434\nLHM2018-05-24_11:59:00.000\n')
+    canada = write_race(tmp_path / 'canada',
+                        'SVF2018-06-10_12:00:00.000\nVBM2018-06-10_12:00:00.000\nLHM2018-06-10_12:00:00.000\n',
+                        'SVF2018-06-10_12:01:30.000\nVBM2018-06-10_12:01:20.000\nLHM2018-06-10_12:01:25.000\n')
+    assert race_to_db('Monaco 2018', *monaco) == 3
+    assert race_to_db('Monaco 2018', *monaco) == 0
+    assert store_race('Canada 2018', read_race(*canada)) == 3
+    assert current_data_version() == 2
+    assert latest_season() == 2018
+    assert RaceTable.select().count() == 2
+    monaco_results = (RaceResultTable
+                      .select(RaceResultTable.abbreviation, RaceResultTable.place)
+                      .join(RaceTable)
+                      .where(RaceTable.name == 'Monaco 2018')
+                      .tuples())
+    assert dict(monaco_results) == {'SVF': 1, 'VBM': 2, 'LHM': None}
+    assert list(standings_query(2018)) == [('VBM', 'Valtteri Bottas', 'MERCEDES', 43, 2, 1, 1),
+                                           ('SVF', 'Sebastian Vettel', 'FERRARI', 40, 2, 1, 1),
+                                           ('LHM', 'Lewis Hamilton', 'MERCEDES', 18, 2, 0, 2)]
+    assert list(standings_query(2017)) == []
+    tear_down_db()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ingest_race_directories(tmp_path, workers):
+    setup_db()
+    for season, day in (('2017', '2017-05-28'), ('2018', '2018-05-24')):
+        (tmp_path / season).mkdir()
+        write_race(tmp_path / season / 'monaco', f'SVF{day}_12:00:00.000\nVBM{day}_12:00:00.000\n',
+                   f'SVF{day}_12:01:04.415\nVBM{day}_12:01:12.434\n')
+    (tmp_path / 'notes').mkdir()
+    progress = []
+    assert ingest_race_directories(str(tmp_path), workers=workers, races_per_commit=1,
+                                   progress=lambda *args: progress.append(args)) == 4
+    assert [(done, total) for done, total, race_name, racers in progress] == [(1, 2), (2, 2)]
+    assert sorted((race_name, racers) for done, total, race_name, racers in progress) == [('2017/monaco', 2),
+                                                                                          ('2018/monaco', 2)]
+    assert [(race.name, race.season) for race in RaceTable.select().order_by(RaceTable.name)] == \
+        [('2017/monaco', 2017), ('2018/monaco', 2018)]
+    assert current_data_version() == 2
+    assert ingest_race_directories(str(tmp_path), workers=workers) == 0
+    assert current_data_version() == 2
+    tear_down_db()
+
+
+@pytest.mark.parametrize("option", ['--workers', '--races-per-commit'])
+def test_ingest_races_command_rejects_zero(tmp_path, option):
+    result = app.test_cli_runner().invoke(args=['ingest-races', str(tmp_path), option, '0'])
+    assert result.exit_code == 2
+    assert 'x>=1' in result.output